@@ -14,6 +14,7 @@ parameters:
         main()函数提供1个参数(type)
             type = 1: 绘制时序图
             type = 2: 绘制降雨空间分布图
+            type = 3: 计算shapefile中每个要素（如各州、各县）的降雨均值时序并保存为csv文件
 usage：
     main(type=1)
     无输出
@@ -27,14 +28,24 @@ import shapefile
 from shapely.ops import cascaded_union, unary_union
 from shapely.geometry import Point, Polygon
 from datetime import datetime, timedelta
+import csv
+import os, re, tempfile, shutil, json, hashlib
+from concurrent.futures import ProcessPoolExecutor
 
 from mpl_toolkits.basemap import Basemap
+from region_mask import get_region_mask, read_shapefile_features, get_shapefile_hash
+from zonal_statistics import get_zonal_weights, zonal_mean
 import geopandas as gpd
 import warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
 dirname = r'./Data/GPM'
 SHAPEFILEPATH = r'./Data/USA_shp/jiazhou_merge.shp'
+GPM_SINCE_TIME = datetime(1970, 1, 1, 0, 0, 0)
+GPM_CACHE_DIR = r'./Results/GPM_cache'
+GPM_FILENAME_TIME_PATTERN = re.compile(r'\.(\d{8})-S(\d{6})-(?:E(\d{6}))?')
+# 文件名和Grid/time_bnds中都没有结束时间时，单个时刻代表的时长（GPM半小时数据）
+GPM_TIME_STEP = timedelta(minutes=30)
 
 def get_filenames(dirname:str, suffix):
     '''
@@ -52,43 +63,592 @@ def get_filenames(dirname:str, suffix):
     fullabspaths = [filepath.resolve() for filepath in filepaths]
     return filepaths, fullabspaths
 
-def GPM_readdata(dirname:str, variable='precipitationCal'):
+def _GPM_read_time(f):
+    """
+    读取已打开的GPM文件中的时间（Grid/time，自1970-01-01起的秒数）
+    :param f: h5py.File
+    :return:
+        list[datetime]
+    """
+    return [timedelta(seconds=float(seconds)) + GPM_SINCE_TIME for seconds in f['Grid']['time'][:]]
+
+def get_region_bbox(region):
+    """
+    获取研究区域的经纬度范围
+    :param region: str | PosixPath | tuple
+        shapefile文件路径，或(min_lon, max_lon, min_lat, max_lat)
+    :return:
+        (min_lon, max_lon, min_lat, max_lat)
+    """
+    if isinstance(region, (str, Path)):
+        min_lon, min_lat, max_lon, max_lat = shapefile.Reader(str(region)).bbox
+        return min_lon, max_lon, min_lat, max_lat
+    min_lon, max_lon, min_lat, max_lat = region
+    return min_lon, max_lon, min_lat, max_lat
+
+def get_grid_subset_index(lon, lat, region):
+    """
+    将研究区域转换为GPM格网（0.1°）上的经度、纬度索引范围，范围向外扩展一个格网
+    :param lon: np.ndarray(1-D), 格网中心经度，递增
+    :param lat: np.ndarray(1-D), 格网中心纬度，递增
+    :param region: str | PosixPath | tuple
+        shapefile文件路径，或(min_lon, max_lon, min_lat, max_lat)
+    :return:
+        lon_slice: slice
+        lat_slice: slice
+    """
+    min_lon, max_lon, min_lat, max_lat = get_region_bbox(region)
+    half_dlon = abs(float(lon[1] - lon[0])) / 2
+    half_dlat = abs(float(lat[1] - lat[0])) / 2
+    lon_start = max(int(np.searchsorted(lon + half_dlon, min_lon, side='right')) - 1, 0)
+    lon_stop = min(int(np.searchsorted(lon - half_dlon, max_lon, side='left')) + 1, len(lon))
+    lat_start = max(int(np.searchsorted(lat + half_dlat, min_lat, side='right')) - 1, 0)
+    lat_stop = min(int(np.searchsorted(lat - half_dlat, max_lat, side='left')) + 1, len(lat))
+    if lon_start >= lon_stop or lat_start >= lat_stop:
+        raise ValueError(f"region {get_region_bbox(region)} is outside the grid")
+    return slice(lon_start, lon_stop), slice(lat_start, lat_stop)
+
+def _GPM_read_grid(filepath, region=None):
+    """
+    读取GPM文件的经纬度，并根据研究区域计算读取变量时使用的hyperslab索引
+    :param filepath: str | PosixPath
+    :param region: None | str | PosixPath | tuple
+        None时读取全球格网
+    :return:
+        index: tuple, (time, lon, lat)三个维度的切片
+        lon: np.ndarray
+        lat: np.ndarray
+    """
+    with h5py.File(filepath, 'r') as f:
+        lon = f['Grid']['lon'][:]
+        lat = f['Grid']['lat'][:]
+    if region is None:
+        return np.s_[:, :, :], lon, lat
+    lon_slice, lat_slice = get_grid_subset_index(lon, lat, region)
+    return np.s_[:, lon_slice, lat_slice], lon[lon_slice], lat[lat_slice]
+
+def GPM_iter_slabs(dirname:str, variable='precipitationCal', region=None):
+    """
+        逐个文件读取GPM文件的单个变量，每次只返回一个文件的(time, lon, lat)切片，内存占用与文件数量无关
+    :param dirname:
+    :param variable: 变量名
+    :param region: None | str | PosixPath | tuple
+        研究区域（shapefile文件路径或(min_lon, max_lon, min_lat, max_lat)），提供时只读取区域范围内的格网
+    :return: generator
+        每次返回 time_list: list[datetime], slab: np.ndarray(3-D)，slab中的-9999已替换为np.nan
+    """
+    filenames, fullabspaths = get_filenames(dirname, suffix='.HDF5')
+    if len(fullabspaths) == 0:
+        return
+    index, lon, lat = _GPM_read_grid(fullabspaths[0], region)
+    for filepath in fullabspaths:
+        with h5py.File(filepath, 'r') as f:
+            slab = f['Grid'][variable][index]
+            time_list = _GPM_read_time(f)
+        slab[slab < 0] = np.nan
+        yield time_list, slab
+
+def _GPM_read_file_into(filepath, variable, index, full_shape, out, start):
+    """
+    读取单个GPM文件的变量并原地写入输出数组out[start:start+time]，同时将-9999替换为np.nan
+    :param filepath: str | PosixPath
+    :param variable: 变量名
+    :param index: tuple, hyperslab索引
+    :param full_shape: tuple, 文件中变量的形状，用于检查所有文件格网是否一致
+    :param out: np.ndarray | np.memmap
+    :param start: int, 写入位置
+    :return:
+        time_list: list[datetime]
+    """
+    with h5py.File(filepath, 'r') as f:
+        dset = f['Grid'][variable]
+        if dset.shape != full_shape:
+            raise ValueError(f"{filepath} has shape {dset.shape}, expected {full_shape}")
+        dset.read_direct(out, source_sel=index, dest_sel=np.s_[start:start + full_shape[0]])
+        time_list = _GPM_read_time(f)
+    # # 替换-9999，逐个时间切片原地替换，避免生成与整个数组同样大小的布尔临时数组
+    for slab in out[start:start + full_shape[0]]:
+        slab[slab < 0] = np.nan
+    return time_list
+
+def _GPM_read_file_into_memmap(args):
+    """
+    并行读取时子进程执行的任务：打开共享的内存映射文件，写入单个GPM文件的数据
+    :param args: tuple, (filepath, variable, index, full_shape, memmap_path, start)
+    :return:
+        time_list: list[datetime]
+    """
+    filepath, variable, index, full_shape, memmap_path, start = args
+    out = np.load(memmap_path, mmap_mode='r+')
+    time_list = _GPM_read_file_into(filepath, variable, index, full_shape, out, start)
+    out.flush()
+    del out
+    return time_list
+
+def GPM_readdata(dirname:str, variable='precipitationCal', region=None, workers=1, memmap_path=None):
     """
         批量读取GPM文件的单个变量
+        先读取第一个文件确定格网大小并一次性分配输出数组，再逐个文件原地填充，运行时间与文件数量成线性关系
     :param dirname:
     :param variable: 变量名
+    :param region: None | str | PosixPath | tuple
+        研究区域（shapefile文件路径或(min_lon, max_lon, min_lat, max_lat)），
+        提供时只读取区域范围内的格网（h5py hyperslab），返回的lon、lat也只包含该范围
+    :param workers: int
+        读取文件的进程数，大于1时多个进程并行解压、读取文件，并按时间顺序写入同一个内存映射文件
+    :param memmap_path: str | PosixPath | None
+        workers大于1时内存映射文件(.npy)的保存路径，为None时使用系统临时目录，读取完成后删除文件（Windows下保留）
     :return:
-        data: np.ndarray
+        data: np.ndarray，workers大于1时为np.memmap
         lon: np.ndarray
         lat: np.ndarray
         time_arr np.ndarray
     """
     filenames, fullabspaths = get_filenames(dirname, suffix='.HDF5')
-    count = 0
+    if len(fullabspaths) == 0:
+        raise FileNotFoundError(f"no .HDF5 file in {dirname}")
+    index, lon, lat = _GPM_read_grid(fullabspaths[0], region)
+    with h5py.File(fullabspaths[0], 'r') as f:
+        full_shape = f['Grid'][variable].shape
+        dtype = f['Grid'][variable].dtype
+    n_time = full_shape[0]
+    data_shape = (len(fullabspaths) * n_time, len(lon), len(lat))
     time_list = []
-    since_time = datetime.strptime('1970-01-01 00:00:00', '%Y-%m-%d %H:%M:%S')
+    if workers <= 1:
+        data = np.empty(data_shape, dtype=dtype)
+        for count, filepath in enumerate(fullabspaths):
+            time_list.extend(_GPM_read_file_into(filepath, variable, index, full_shape, data, count * n_time))
+        return data, lon, lat, np.array(time_list)
+
+    remove_memmap = memmap_path is None
+    if remove_memmap:
+        fd, memmap_path = tempfile.mkstemp(suffix='.npy')
+        os.close(fd)
+    data = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=dtype, shape=data_shape)
+    tasks = [(filepath, variable, index, full_shape, str(memmap_path), count * n_time)
+             for count, filepath in enumerate(fullabspaths)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # executor.map按提交顺序返回结果，时间顺序与文件顺序一致
+        for file_time_list in executor.map(_GPM_read_file_into_memmap, tasks):
+            time_list.extend(file_time_list)
+    if remove_memmap:
+        try:
+            # Linux/macOS下删除文件后已建立的内存映射仍然有效，磁盘空间在data释放后回收
+            os.remove(memmap_path)
+        except PermissionError:
+            pass
+    return data, lon, lat, np.array(time_list)
+
+def GPM_iter_chunks(dirname:str, variable='precipitationCal', region=None, max_memory_mb=512):
+    """
+        按时间分块读取GPM文件的单个变量，每块包含尽可能多的文件但不超过max_memory_mb，
+        所有块共用同一个预先分配的缓冲区，峰值内存与文件数量无关
+        注意：返回的chunk是缓冲区的视图，读取下一块时会被覆盖，需要保留时请复制
+    :param dirname:
+    :param variable: 变量名
+    :param region: None | str | PosixPath | tuple
+        研究区域（shapefile文件路径或(min_lon, max_lon, min_lat, max_lat)），提供时只读取区域范围内的格网
+    :param max_memory_mb: int | float
+        缓冲区大小上限(MB)，至少容纳一个文件
+    :return: generator
+        每次返回 time_arr: np.ndarray(1-D), chunk: np.ndarray(3-D, (time, lon, lat))，-9999已替换为np.nan
+    """
+    filenames, fullabspaths = get_filenames(dirname, suffix='.HDF5')
+    if len(fullabspaths) == 0:
+        return
+    index, lon, lat = _GPM_read_grid(fullabspaths[0], region)
+    with h5py.File(fullabspaths[0], 'r') as f:
+        full_shape = f['Grid'][variable].shape
+        dtype = f['Grid'][variable].dtype
+    n_time = full_shape[0]
+    file_nbytes = n_time * len(lon) * len(lat) * dtype.itemsize
+    files_per_chunk = max(1, int(max_memory_mb * 1024 ** 2 // file_nbytes))
+    buffer = np.empty((files_per_chunk * n_time, len(lon), len(lat)), dtype=dtype)
+    for chunk_start in range(0, len(fullabspaths), files_per_chunk):
+        chunk_paths = fullabspaths[chunk_start:chunk_start + files_per_chunk]
+        time_list = []
+        for count, filepath in enumerate(chunk_paths):
+            time_list.extend(_GPM_read_file_into(filepath, variable, index, full_shape, buffer, count * n_time))
+        yield np.array(time_list), buffer[:len(chunk_paths) * n_time]
+
+def GPM_chunked_statistics(dirname:str, shapefile_path=None, variable='precipitationCal', region=None,
+                           max_memory_mb=512, step_hours=0.5):
+    """
+        按时间分块流式计算GPM数据的统计量，不需要把全部数据读入内存
+        峰值内存约为 max_memory_mb + 7个float32格网大小（float64的累计降雨量和最大值、单块最大值、
+        单个时刻的缺测值掩膜及读取文件时h5py的临时数组），与文件数量无关
+    :param dirname:
+    :param shapefile_path: str | None
+        提供时计算区域面积加权均值时序，并且（region为None时）只读取区域范围内的格网
+    :param variable: 变量名
+    :param region: None | str | PosixPath | tuple
+        读取范围，见GPM_readdata
+    :param max_memory_mb: int | float
+        读取缓冲区大小上限(MB)
+    :param step_hours: float
+        单个时刻代表的时长(小时)，GPM半小时数据为0.5，用于由降雨强度(mm/hr)计算累计降雨量(mm)
+    :return:
+        dict
+            'time': np.ndarray(1-D)
+            'accumulation': np.ndarray(2-D, (lon, lat))，累计降雨量，缺测值不计入
+            'maximum': np.ndarray(2-D, (lon, lat))，最大降雨强度，全部缺测时为nan
+            'basin_mean': np.ndarray(1-D)，区域均值时序，未提供shapefile_path时为None
+            'lon', 'lat': np.ndarray(1-D)
+    """
+    if region is None:
+        region = shapefile_path
+    filenames, fullabspaths = get_filenames(dirname, suffix='.HDF5')
+    if len(fullabspaths) == 0:
+        raise FileNotFoundError(f"no .HDF5 file in {dirname}")
+    _, lon, lat = _GPM_read_grid(fullabspaths[0], region)
+    weights = get_zonal_weights(shapefile_path, lon, lat) if shapefile_path is not None else None
+
+    accumulation = np.zeros((len(lon), len(lat)), dtype=np.float64)
+    maximum = np.full((len(lon), len(lat)), -np.inf, dtype=np.float64)
+    time_list, basin_mean = [], []
+    for time_arr, chunk in GPM_iter_chunks(dirname, variable, region, max_memory_mb):
+        time_list.extend(time_arr)
+        np.fmax(maximum, np.fmax.reduce(chunk, axis=0), out=maximum)
+        if weights is not None:
+            basin_mean.extend(zonal_mean(chunk, weights)[:, 0])
+        # 逐个时刻在缓冲区上原地将nan置0后累加，临时数组只有一个格网大小（np.nansum会复制整个块）
+        for slab in chunk:
+            np.copyto(slab, 0, where=np.isnan(slab))
+            accumulation += slab
+    accumulation *= step_hours
+    maximum[np.isneginf(maximum)] = np.nan
+    return {'time': np.array(time_list), 'accumulation': accumulation, 'maximum': maximum,
+            'basin_mean': np.array(basin_mean) if weights is not None else None, 'lon': lon, 'lat': lat}
+
+def _GPM_read_time_bounds(filepath):
+    """
+    从文件中读取起止时间，结束时间取Grid/time_bnds，没有时取最后一个时刻加GPM_TIME_STEP
+    :param filepath: PosixPath
+    :return:
+        datetime, datetime
+    """
+    with h5py.File(filepath, 'r') as f:
+        time_list = _GPM_read_time(f)
+        if 'time_bnds' in f['Grid']:
+            return time_list[0], timedelta(seconds=float(f['Grid']['time_bnds'][-1, 1])) + GPM_SINCE_TIME
+    return time_list[0], time_list[-1] + GPM_TIME_STEP
+
+def GPM_granule_index(dirname:str):
+    """
+    建立GPM文件的时间索引，起止时间从文件名中解析（如3B-HHR-E.MS.MRG.3IMERG.20240201-S000000-E002959.0000.V06B.HDF5
+    中的20240201-S000000和E002959，结束时间为E之后的1秒，即00:30:00），文件名不符合该格式时才打开文件读取
+    :param dirname:
+    :return:
+        fullabspaths: list[PosixPath]
+        time_arr: np.ndarray(1-D)，每个文件的起始时间
+        end_arr: np.ndarray(1-D)，每个文件的结束时间（不包含）
+    """
+    filenames, fullabspaths = get_filenames(dirname, suffix='.HDF5')
+    time_list, end_list = [], []
     for filepath in fullabspaths:
-        with h5py.File(filepath, 'r') as f:
-            if count == 0:
-                data = f['Grid'][variable][:]
-                lon = f['Grid']['lon'][:]
-                lat = f['Grid']['lat'][:]
-                interval_seconds = float(f['Grid']['time'][:][0])
-                time = timedelta(seconds=interval_seconds) + since_time
-                time_list.append(time)
-                count += 1
-            else:
-                data_1 = f['Grid'][variable][:]
-                data = np.concatenate((data, data_1), 0)
-                interval_seconds = float(f['Grid']['time'][:][0])
-                time = timedelta(seconds=interval_seconds) + since_time
-                time_list.append(time)
-                count += 1
-    time_arr = np.array(time_list)
-    # # 替换-9999
-    data[data < 0] = np.nan
+        match = GPM_FILENAME_TIME_PATTERN.search(filepath.name)
+        if match and match.group(3):
+            start = datetime.strptime(match.group(1) + match.group(2), '%Y%m%d%H%M%S')
+            end = datetime.strptime(match.group(1) + match.group(3), '%Y%m%d%H%M%S') + timedelta(seconds=1)
+            if end <= start:
+                # 跨越午夜的文件（如S233000-E235959的结束时间为次日00:00:00）
+                end += timedelta(days=1)
+        elif match:
+            start = datetime.strptime(match.group(1) + match.group(2), '%Y%m%d%H%M%S')
+            end = _GPM_read_time_bounds(filepath)[1]
+        else:
+            start, end = _GPM_read_time_bounds(filepath)
+        time_list.append(start)
+        end_list.append(end)
+    return fullabspaths, np.array(time_list), np.array(end_list)
+
+def GPM_select_granule(dirname:str, count=None, time=None):
+    """
+    按序号或时间选择单个GPM文件，见GPM_read_granule
+    :param dirname:
+    :param count: int | None
+    :param time: datetime | None
+    :return:
+        PosixPath
+    """
+    if (count is None) == (time is None):
+        raise ValueError("provide exactly one of count and time.")
+    if time is None:
+        filenames, fullabspaths = get_filenames(dirname, suffix='.HDF5')
+        if not 1 <= count <= len(fullabspaths):
+            raise IndexError(f"count {count} out of range, {len(fullabspaths)} files in {dirname}")
+        return fullabspaths[count - 1]
+    fullabspaths, time_arr, end_arr = GPM_granule_index(dirname)
+    position = int(np.searchsorted(time_arr, time, side='right')) - 1
+    if position < 0:
+        raise ValueError(f"no GPM file starts before {time}")
+    if time >= end_arr[position]:
+        # time在最后一个文件之后，或所在时段的文件缺失
+        raise ValueError(f"no GPM file covers {time}, the last file starting before it ends at {end_arr[position]}")
+    return fullabspaths[position]
+
+def GPM_read_granule(dirname:str, count=None, time=None, variable='precipitationCal', region=None):
+    """
+        只读取单个GPM文件，可按序号或时间选择，读取时间与文件夹中的文件数量无关
+    :param dirname:
+    :param count: int | None
+        第count个文件（从1开始，按文件名排序）
+    :param time: datetime | None
+        选择起始时间不晚于time的最后一个文件，即time所在的时段；time不在该文件的起止时间内
+        （在最后一个文件之后或所在时段的文件缺失）时报错
+    :param variable: 变量名
+    :param region: None | str | PosixPath | tuple
+        研究区域，提供时只读取区域范围内的格网，见GPM_readdata
+    :return:
+        data: np.ndarray, (time, lon, lat)
+        lon: np.ndarray
+        lat: np.ndarray
+        time_arr: np.ndarray
+    """
+    return _GPM_read_single_file(GPM_select_granule(dirname, count, time), variable, region)
+
+def _GPM_read_single_file(filepath, variable='precipitationCal', region=None):
+    index, lon, lat = _GPM_read_grid(filepath, region)
+    with h5py.File(filepath, 'r') as f:
+        full_shape = f['Grid'][variable].shape
+        dtype = f['Grid'][variable].dtype
+    data = np.empty((full_shape[0], len(lon), len(lat)), dtype=dtype)
+    time_list = _GPM_read_file_into(filepath, variable, index, full_shape, data, 0)
+    return data, lon, lat, np.array(time_list)
+
+def GPM_aggregate(dirname:str, freq='day', shapefile_path=None, variable='precipitationCal', region=None,
+                  step_hours=0.5, event_threshold=0.1, event_gap_hours=6):
+    """
+        按时间流式累计GPM降雨量（小时、日、降雨场次），逐个文件读取并在当前时段的累计数组上原地累加，
+        每个时段结束时返回该时段的累计结果，内存只与单个时段的格网大小有关，与数据时长无关
+    :param dirname:
+    :param freq: str
+        'hour'：按小时累计
+        'day'：按日累计，default
+        'event'：按降雨场次累计，需要提供shapefile_path，区域均值降雨强度大于event_threshold的时刻为有雨时刻，
+                 相邻有雨时刻间隔不超过event_gap_hours时属于同一场降雨
+    :param shapefile_path: str | None
+        提供时同时计算区域面积加权累计降雨量，并且（region为None时）只读取区域范围内的格网
+    :param variable: 变量名
+    :param region: None | str | PosixPath | tuple
+        读取范围，见GPM_readdata
+    :param step_hours: float
+        单个时刻代表的时长(小时)，GPM半小时数据为0.5
+    :param event_threshold: float
+        freq='event'时判断有雨的区域均值降雨强度阈值(mm/hr)
+    :param event_gap_hours: float
+        freq='event'时同一场降雨中允许的最长无雨间隔(小时)
+    :return: generator
+        每个时段返回dict
+            'start': datetime，时段内第一个时刻
+            'end': datetime，时段内最后一个时刻加step_hours
+            'n_steps': int，时段内的时刻数
+            'total': np.ndarray(2-D, (lon, lat))，累计降雨量(mm)，缺测值不计入
+            'basin_total': float，区域累计降雨量(mm)，未提供shapefile_path时为None
+    """
+    if freq not in ('hour', 'day', 'event'):
+        raise ValueError("freq is wrong.")
+    if freq == 'event' and shapefile_path is None:
+        raise ValueError("freq='event' needs shapefile_path.")
+    if region is None:
+        region = shapefile_path
+    filenames, fullabspaths = get_filenames(dirname, suffix='.HDF5')
+    if len(fullabspaths) == 0:
+        return
+    _, lon, lat = _GPM_read_grid(fullabspaths[0], region)
+    weights = get_zonal_weights(shapefile_path, lon, lat) if shapefile_path is not None else None
+    step = timedelta(hours=step_hours)
+
+    def new_bin(time):
+        return {'start': time, 'end': time + step, 'n_steps': 0,
+                'total': np.zeros((len(lon), len(lat)), dtype=np.float64),
+                'basin_total': 0.0 if weights is not None else None}
+
+    def add_step(current, time, grid, basin_mean):
+        current['end'] = time + step
+        current['n_steps'] += 1
+        current['total'] += np.nan_to_num(grid) * step_hours
+        if weights is not None:
+            current['basin_total'] += np.nan_to_num(basin_mean) * step_hours
+
+    current, bin_key = None, None
+    # 场次累计时，尚未确定是否属于当前场次的无雨时刻先累计在pending中
+    pending, dry_hours = None, 0.0
+    for time_list, slab in GPM_iter_slabs(dirname, variable, region):
+        basin_means = zonal_mean(slab, weights)[:, 0] if weights is not None else [None] * len(slab)
+        for time, grid, basin_mean in zip(time_list, slab, basin_means):
+            if freq != 'event':
+                key = time.replace(minute=0, second=0, microsecond=0) if freq == 'hour' else time.date()
+                if current is not None and key != bin_key:
+                    yield current
+                    current = None
+                if current is None:
+                    current, bin_key = new_bin(time), key
+                add_step(current, time, grid, basin_mean)
+                continue
+
+            is_wet = basin_mean > event_threshold
+            if current is None:
+                if is_wet:
+                    current = new_bin(time)
+                    add_step(current, time, grid, basin_mean)
+                continue
+            if is_wet:
+                if pending is not None:
+                    current['n_steps'] += pending['n_steps']
+                    current['total'] += pending['total']
+                    current['basin_total'] += pending['basin_total']
+                    pending, dry_hours = None, 0.0
+                add_step(current, time, grid, basin_mean)
+                continue
+            if pending is None:
+                pending = new_bin(time)
+            add_step(pending, time, grid, basin_mean)
+            dry_hours += step_hours
+            if dry_hours > event_gap_hours:
+                yield current
+                current, pending, dry_hours = None, None, 0.0
+    if current is not None:
+        yield current
+
+def _GPM_file_entry(filepath):
+    """
+    GPM文件在缓存索引中的标识（文件名、大小、修改时间）
+    :param filepath: PosixPath
+    :return:
+        dict
+    """
+    stat = filepath.stat()
+    return {'name': filepath.name, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+def _GPM_write_cache_index(index_path, cache_index):
+    """
+    写入缓存索引，先写入临时文件再替换，避免中断时索引文件损坏
+    """
+    tmp_path = index_path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(cache_index, f)
+    os.replace(tmp_path, index_path)
+
+def _GPM_cache_layout(dirname, filepath, variable, region, cache_dir):
+    """
+    GPM缓存子目录及其格网信息，子目录由数据文件夹（绝对路径）、变量名、读取范围、单个文件的格网形状和数据类型确定，
+    不同的数据文件夹使用同一cache_dir时互不影响
+    :return:
+        cache_path: PosixPath
+        index: tuple, 读取范围的格网索引，见_GPM_read_grid
+        lon, lat: np.ndarray
+        full_shape: tuple, 单个文件中变量的形状
+        dtype: np.dtype
+    """
+    index, lon, lat = _GPM_read_grid(filepath, region)
+    with h5py.File(filepath, 'r') as f:
+        full_shape = f['Grid'][variable].shape
+        dtype = f['Grid'][variable].dtype
+    key = hashlib.sha1(f'{Path(dirname).resolve()}{variable}{index}{full_shape}{dtype}'.encode()).hexdigest()[:16]
+    return Path(cache_dir).joinpath(f'{variable}_{key}'), index, lon, lat, full_shape, dtype
+
+def GPM_read_cached_granule(filepath, variable='precipitationCal', region=None, cache_dir=GPM_CACHE_DIR):
+    """
+        从GPM_update_cache建立的缓存中读取单个文件的数据，不读取、不更新其它文件
+    :param filepath: str | PosixPath
+    :param variable: 变量名
+    :param region: None | str | PosixPath | tuple
+        读取范围，需与建立缓存时一致
+    :param cache_dir: str | PosixPath
+    :return:
+        None（文件未缓存或缓存后被修改）| (data, lon, lat, time_arr)，同GPM_read_granule
+    """
+    filepath = Path(filepath)
+    cache_path, index, lon, lat, full_shape, dtype = _GPM_cache_layout(filepath.parent, filepath, variable, region, cache_dir)
+    index_path = cache_path.joinpath('index.json')
+    grids_path = cache_path.joinpath('grids.dat')
+    if not index_path.exists():
+        return None
+    with open(index_path, 'r') as f:
+        cache_index = json.load(f)
+    entry = _GPM_file_entry(filepath)
+    for position, cached in enumerate(cache_index['files']):
+        if {k: cached[k] for k in ('name', 'size', 'mtime')} == entry:
+            break
+    else:
+        return None
+    slab_shape = (full_shape[0], len(lon), len(lat))
+    slab_nbytes = int(np.prod(slab_shape)) * dtype.itemsize
+    if grids_path.stat().st_size < (position + 1) * slab_nbytes:
+        return None
+    data = np.memmap(grids_path, dtype=dtype, mode='r', shape=slab_shape, offset=position * slab_nbytes)
+    time_arr = np.array([datetime.fromisoformat(time) for time in cache_index['files'][position]['times']])
     return data, lon, lat, time_arr
 
+def GPM_update_cache(dirname:str, variable='precipitationCal', region=None, cache_dir=GPM_CACHE_DIR):
+    """
+        增量更新GPM数据的磁盘缓存并返回缓存中的全部数据
+        缓存按文件名、大小和修改时间记录已读取的文件，只读取新增的文件并追加到缓存末尾；
+        已缓存的文件被修改、删除，或新增文件的文件名排在已缓存文件之前时，重新建立缓存
+        缓存目录结构（每个数据文件夹、变量和读取范围一个子目录）：
+            index.json: 已读取文件的标识和时间
+            lon.npy, lat.npy: 格网经纬度
+            grids.dat: 所有时刻的格网数据（二进制，按时间顺序追加）
+            series_*.npy: get_in_shape_time_series计算的区域时序
+    :param dirname:
+    :param variable: 变量名
+    :param region: None | str | PosixPath | tuple
+        研究区域（shapefile文件路径或(min_lon, max_lon, min_lat, max_lat)），提供时只缓存区域范围内的格网
+    :param cache_dir: str | PosixPath
+        缓存目录，默认为"./Results/GPM_cache"
+    :return:
+        data: np.memmap, (time, lon, lat)
+        lon: np.ndarray
+        lat: np.ndarray
+        time_arr: np.ndarray
+        cache_path: PosixPath, 本次使用的缓存子目录
+    """
+    filenames, fullabspaths = get_filenames(dirname, suffix='.HDF5')
+    if len(fullabspaths) == 0:
+        raise FileNotFoundError(f"no .HDF5 file in {dirname}")
+    cache_path, index, lon, lat, full_shape, dtype = _GPM_cache_layout(dirname, fullabspaths[0], variable, region, cache_dir)
+    index_path = cache_path.joinpath('index.json')
+    grids_path = cache_path.joinpath('grids.dat')
+    slab_shape = (full_shape[0], len(lon), len(lat))
+    slab_nbytes = int(np.prod(slab_shape)) * dtype.itemsize
+
+    entries = [_GPM_file_entry(filepath) for filepath in fullabspaths]
+    cache_index = None
+    if index_path.exists():
+        with open(index_path, 'r') as f:
+            cache_index = json.load(f)
+        cached = [{k: e[k] for k in ('name', 'size', 'mtime')} for e in cache_index['files']]
+        if cached != entries[:len(cached)]:
+            cache_index = None
+    if cache_index is None:
+        # 新建或重建缓存，删除旧的格网数据和区域时序
+        if cache_path.exists():
+            shutil.rmtree(cache_path)
+        cache_path.mkdir(parents=True)
+        np.save(cache_path.joinpath('lon.npy'), lon)
+        np.save(cache_path.joinpath('lat.npy'), lat)
+        cache_index = {'files': []}
+        _GPM_write_cache_index(index_path, cache_index)
+
+    n_cached = len(cache_index['files'])
+    with open(grids_path, 'ab') as f:
+        # 截断上次中断时写入了数据但未写入索引的部分
+        f.truncate(n_cached * slab_nbytes)
+        slab = np.empty(slab_shape, dtype=dtype)
+        for filepath, entry in zip(fullabspaths[n_cached:], entries[n_cached:]):
+            time_list = _GPM_read_file_into(filepath, variable, index, full_shape, slab, 0)
+            f.write(slab.tobytes())
+            entry['times'] = [time.isoformat() for time in time_list]
+            cache_index['files'].append(entry)
+        f.flush()
+    if len(cache_index['files']) > n_cached:
+        _GPM_write_cache_index(index_path, cache_index)
+
+    time_arr = np.array([datetime.fromisoformat(time) for e in cache_index['files'] for time in e['times']])
+    data = np.memmap(grids_path, dtype=dtype, mode='r', shape=(len(time_arr), len(lon), len(lat)))
+    return data, lon, lat, time_arr, cache_path
+
 def read_shapefile_boundaries(shapefile_path:str):
     """
     读取shapefile文件（line），并输出边界点的经纬度，分为两种类型，POLYGON 和 np.ndarray
@@ -157,34 +717,61 @@ def find_first_last_indices(arr, number):
             last_index = int(len(arr) - np.argmax(arr[::-1] == number) - 1)
     return first_index, last_index
 
-def get_in_shape_time_series(dirname:str, shapefile_path:str):
+def get_in_shape_time_series(dirname:str, shapefile_path:str, method='area', cache_dir=None):
     """
     读取GPM中的降雨量和指定区域的shapefile文件并返回时序
     :param dirname:
     :param shapefile_path:
+    :param method: str
+        'area'：面积加权均值，按格网与区域的相交面积和cos(纬度)计权，default
+        'mask'：格网中心位于区域内的格网的算术均值
+    :param cache_dir: str | PosixPath | None
+        GPM数据缓存目录（见GPM_update_cache），提供时只读取上次运行后新增的文件，区域时序也只计算新增部分
     :return:
         time_arr: np.ndarray(1-D)
 
         precip_time_series_arr: np.ndarray(1-D)
 
     """
-    # read precipitation data
-    precip, lon, lat, time_arr = GPM_readdata(dirname)
+    if method not in ('area', 'mask'):
+        raise ValueError("method is wrong.")
+    if cache_dir is None:
+        # read precipitation data，只读取shapefile范围内的格网
+        precip, lon, lat, time_arr = GPM_readdata(dirname, region=shapefile_path)
+        return time_arr, _get_region_mean(precip, lon, lat, shapefile_path, method)
+
+    precip, lon, lat, time_arr, cache_path = GPM_update_cache(dirname, region=shapefile_path, cache_dir=cache_dir)
+    series_path = cache_path.joinpath(f'series_{method}_{get_shapefile_hash(shapefile_path)[:16]}.npy')
+    cached_series = np.load(series_path) if series_path.exists() else np.empty(0)
+    n_cached = min(len(cached_series), len(time_arr))
+    new_series = _get_region_mean(precip[n_cached:], lon, lat, shapefile_path, method)
+    precip_time_series_arr = np.concatenate((cached_series[:n_cached], new_series))
+    np.save(series_path, precip_time_series_arr)
+    return time_arr, precip_time_series_arr
+
+def _get_region_mean(precip, lon, lat, shapefile_path, method='area'):
+    """
+    计算每个时刻shapefile区域内的降雨均值
+    :param precip: np.ndarray, (time, lon, lat)
+    :param lon: np.ndarray(1-D)
+    :param lat: np.ndarray(1-D)
+    :param shapefile_path:
+    :param method: str, 'area' | 'mask'，见get_in_shape_time_series
+    :return:
+        precip_time_series_arr: np.ndarray(1-D)
+    """
+    if len(precip) == 0:
+        return np.empty(0)
+    if method == 'area':
+        # 面积加权均值，权重矩阵按shapefile和格网的哈希值缓存，所有时刻通过一次稀疏矩阵乘法计算
+        weights = get_zonal_weights(shapefile_path, lon, lat)
+        return zonal_mean(precip, weights)[:, 0]
 
-    # 制作shapefile_path对应的掩膜文件global_mask2，ndarray
-    outline, polygon = read_shapefile_boundaries(shapefile_path)
-    ## 保留两位小数，并使最后一位小数为5
-    outline_dec2 = round_to_5_with_2_decimals(outline)
-    unique_outline_dec2 = np.unique(outline_dec2, axis=0)
-    unique_lon, unique_lat = unique_outline_dec2[:, 0], unique_outline_dec2[:, 1]
-    ## plt.scatter(unique_lon, unique_lat)
-    global_mask = np.zeros_like(precip[0].T)
-    pcol_index = (10 * (179.95 + unique_lon)).astype(int)
-    prow_index = (10 * (89.95 + unique_lat)).astype(int)
-    global_mask[prow_index, pcol_index] = 1
-    global_mask2 = np.zeros_like(global_mask)
+    # 制作shapefile_path对应的掩膜global_mask2，ndarray(bool)，格网中心位于shapefile内为True
+    # 掩膜只计算一次，并按shapefile和格网的哈希值缓存在磁盘上，再次运行时直接读取
+    global_mask2 = get_region_mask(shapefile_path, lon, lat)
     """
-    global_mask, global_mask2格网格式
+    global_mask2格网格式（以全球格网为例，读取区域子集时范围为lon[0]~lon[-1], lat[0]~lat[-1]）
                 -179.95 -179.85 ......179.85 179.95     -----longitude
         -89.95      *       *      *    *       *
         -89.85      *       *      *    *       *
@@ -198,52 +785,70 @@ def get_in_shape_time_series(dirname:str, shapefile_path:str):
           |
         latitude        
     """
-    # 绘制区域降雨时序图
-    precip_time_series = []
-    for i in range(len(time_arr)):
-        data = precip[i].T
-        """
-        data = precip[0].T格网格式
-                -179.95 -179.85 ......179.85 179.95     -----longitude
-        -89.95      *       *      *    *       *
-        -89.85      *       *      *    *       *
-           .        *       *      *    *       *
-           .        *       *      *    *       *
-           .        *       *      *    *       *
-        89.85       *       *      *    *       *
-        89.95       *       *      *    *       *
-          |
-          |
-          |
-        latitude
-        """
-
-
-
-        for row in range(len(lat)):
-            row_mask = global_mask[row, :]
-            first_index, last_index = find_first_last_indices(row_mask, number=1)
-            if first_index != 0:
-                row_mask[first_index:last_index] = 1
-                global_mask2[row, :] = row_mask
-        len_mask_point = np.sum(global_mask2[global_mask2 == 1])
-        mask_data = data * global_mask2
-        mask_data[np.isnan(mask_data)] = 0
-        inshp_mean_data = np.sum(mask_data) / len_mask_point
-        precip_time_series.append(inshp_mean_data)
-    precip_time_series_arr = np.array(precip_time_series)
-    return time_arr, precip_time_series_arr
+    # 计算区域降雨均值时序，precip格网格式为(time, lon, lat)，因此使用global_mask2.T，
+    # 所有时间一次完成掩膜提取和求和，缺测值(nan)按0计算
+    len_mask_point = np.count_nonzero(global_mask2)
+    return np.nansum(precip[:, global_mask2.T], axis=1) / len_mask_point
+
+def get_regions_time_series(dirname:str, shapefile_path:str, name_field=None,
+                            savepath='./Results/GPM regions time series.csv'):
+    """
+    读取GPM中的降雨量，计算shapefile中每个要素（如gadm36_USA_2中的各县）的面积加权降雨均值时序，
+    所有要素只需遍历一次GPM文件，每读取一个文件写出一行
+    :param dirname:
+    :param shapefile_path:
+    :param name_field: str | None
+        作为区域名称的属性字段，如'NAME_1'、'GID_2'，为None时使用要素序号
+    :param savepath: str
+        csv文件保存路径
+        文件格式：第一行为区域名称，第一列为时间，中间为数据（time × region）
+    :return:
+        time_arr: np.ndarray(1-D)
+        regions_time_series_arr: np.ndarray(2-D), (time, region)
+        names: list[str]
+    """
+    _, names = read_shapefile_features(shapefile_path, name_field)
+    filenames, fullabspaths = get_filenames(dirname, suffix='.HDF5')
+    if len(fullabspaths) == 0:
+        raise FileNotFoundError(f"no .HDF5 file in {dirname}")
+    _, lon, lat = _GPM_read_grid(fullabspaths[0], region=shapefile_path)
+    weights = get_zonal_weights(shapefile_path, lon, lat, by_feature=True)
+
+    time_list, rows = [], []
+    with open(savepath, 'w', newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(['time'] + names)
+        for slab_time_list, slab in GPM_iter_slabs(dirname, region=shapefile_path):
+            slab_mean = zonal_mean(slab, weights)
+            for time, row in zip(slab_time_list, slab_mean):
+                writer.writerow([time] + row.tolist())
+                time_list.append(time)
+                rows.append(row)
+    print(f'save finished! {savepath}')
+    return np.array(time_list), np.array(rows), names
 
-def plot_precip_map(dirname:str, count=1):
+def plot_precip_map(dirname:str, count=1, time=None, cache_dir=None):
     """
         绘制GPM文件的降雨分布图（单个文件）
     :param dirname:  str
         GPM 文件夹路径
     :param count:   int
         第count个文件
+    :param time: datetime | None
+        提供时绘制time所在时段的文件，忽略count
+    :param cache_dir: str | PosixPath | None
+        GPM数据缓存目录（见GPM_update_cache），所选文件已缓存时从缓存中读取，否则只打开所选的单个文件（不更新缓存）
     :return:
     """
-    precip, lon, lat, time_list = GPM_readdata(dirname)
+    if time is not None:
+        count = None
+    filepath = GPM_select_granule(dirname, count, time)
+    granule = None
+    if cache_dir is not None:
+        granule = GPM_read_cached_granule(filepath, cache_dir=cache_dir)
+    if granule is None:
+        granule = _GPM_read_single_file(filepath)
+    precip, lon, lat, time_list = granule
     fig, ax = plt.subplots(figsize=(12, 8))
 
     m = Basemap(projection="cyl", llcrnrlat=min(lat), urcrnrlat=max(lat),
@@ -258,7 +863,7 @@ def plot_precip_map(dirname:str, count=1):
     x, y = m(lon, lat)
 
     cmap = plt.get_cmap('jet')
-    cs = m.pcolormesh(x, y, precip[count-1].T, cmap=cmap, shading='auto')
+    cs = m.pcolormesh(x, y, precip[0].T, cmap=cmap, shading='auto')
 
 
     cbar = m.colorbar(cs, location='bottom', pad='10%')
@@ -266,20 +871,23 @@ def plot_precip_map(dirname:str, count=1):
     plt.title('PrecipitaionCal')
     plt.show()
 
-def plot_GPM_time_series(dirname:str, shapefile_path=SHAPEFILEPATH):
+def plot_GPM_time_series(dirname:str, shapefile_path=SHAPEFILEPATH, cache_dir=None):
 
-    time_arr, precip_time_series_arr = get_in_shape_time_series(dirname, shapefile_path)
+    time_arr, precip_time_series_arr = get_in_shape_time_series(dirname, shapefile_path, cache_dir=cache_dir)
     plt.plot(time_arr, precip_time_series_arr)
     plt.show()
 
 def main(type=1):
 
     if type == 1:
-        # 绘制时序图
-        plot_GPM_time_series(dirname)
+        # 绘制时序图，使用增量缓存，再次运行时只读取新增的GPM文件
+        plot_GPM_time_series(dirname, cache_dir=GPM_CACHE_DIR)
     elif type == 2:
         # 绘制单个GPM文件降雨分布图, ubuntu
         plot_precip_map(dirname)
+    elif type == 3:
+        # 多区域降雨时序，默认保存路径为"./Results/GPM regions time series.csv"
+        get_regions_time_series(dirname, SHAPEFILEPATH)
 
 if __name__ == "__main__":
     main(type=2)
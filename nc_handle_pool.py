@@ -0,0 +1,181 @@
+"""
+introduce:
+    NetCDF文件句柄池，供plot_CHRTOUT_streamflow_map.py、plot_wrf_output_variable_time_series.py等脚本共用
+    (1) 同时打开的文件数不超过max_open，超过时关闭最久未使用（LRU）且未被固定的文件，避免长时间序列处理时
+        文件描述符耗尽
+    (2) 同一文件重复读取时复用已打开的句柄；文件被修改（mtime或大小变化）时重新打开
+    (3) 使用 with pool.dataset(path) as dataset: 读取时文件在with块内被固定，不会被其它读取操作关闭
+    (4) 记录打开句柄数、命中、未命中和关闭（淘汰）次数，close_all()确定性地关闭所有文件
+    句柄池只用于只读访问，写文件仍直接使用nc.Dataset(path, 'w')
+parameters:
+    DATASET_POOL: DatasetPool
+        共用的句柄池，默认最多同时打开32个文件
+usage:
+    from nc_handle_pool import DATASET_POOL
+    with DATASET_POOL.dataset(filepath) as dataset:
+        streamflow = dataset.variables['streamflow'][:]
+    print(DATASET_POOL.metrics())
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import netCDF4 as nc
+
+
+class DatasetPool:
+    """
+    按LRU策略管理已打开的netCDF4.Dataset（只读）
+    """
+    def __init__(self, max_open=32):
+        """
+        :param max_open: int, 最多同时打开的文件数（被固定的文件超过该数量时暂时超出）
+        """
+        if max_open < 1:
+            raise ValueError("max_open must be at least 1.")
+        self.max_open = max_open
+        self._datasets = OrderedDict()          # key -> (dataset, (mtime_ns, size))
+        self._pins = {}                         # key -> 固定次数
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _key(filepath):
+        return os.path.abspath(str(filepath))
+
+    @staticmethod
+    def _signature(key):
+        stat = os.stat(key)
+        return stat.st_mtime_ns, stat.st_size
+
+    def get(self, filepath):
+        """
+        获取文件的只读句柄，已打开时直接复用，自动掩膜和缩放恢复为netCDF4的默认设置（均为True）
+        :param filepath: str | PosixPath
+        :return:
+            netCDF4.Dataset
+        """
+        key = self._key(filepath)
+        signature = self._signature(key)
+        with self._lock:
+            entry = self._datasets.get(key)
+            if entry is not None and entry[1] == signature and entry[0].isopen():
+                self.hits += 1
+                self._datasets.move_to_end(key)
+                dataset = entry[0]
+                dataset.set_auto_maskandscale(True)
+                return dataset
+            if entry is not None:
+                self._close_key(key)
+            self.misses += 1
+            dataset = nc.Dataset(key, 'r')
+            self._datasets[key] = (dataset, signature)
+            self._evict()
+            return dataset
+
+    def _evict(self):
+        # 最近打开的文件不淘汰
+        for key in list(self._datasets)[:-1]:
+            if len(self._datasets) <= self.max_open:
+                break
+            if self._pins.get(key, 0) == 0:
+                self._close_key(key)
+                self.evictions += 1
+
+    def _close_key(self, key):
+        dataset, _ = self._datasets.pop(key)
+        if dataset.isopen():
+            dataset.close()
+
+    def pin(self, filepath):
+        """
+        固定文件，固定期间不会被LRU策略关闭，需与unpin成对调用
+        :param filepath: str | PosixPath
+        :return:
+            netCDF4.Dataset
+        """
+        with self._lock:
+            dataset = self.get(filepath)
+            key = self._key(filepath)
+            self._pins[key] = self._pins.get(key, 0) + 1
+            return dataset
+
+    def unpin(self, filepath):
+        """
+        :param filepath: str | PosixPath
+        :return: None
+        """
+        with self._lock:
+            key = self._key(filepath)
+            count = self._pins.get(key, 0) - 1
+            if count > 0:
+                self._pins[key] = count
+            else:
+                self._pins.pop(key, None)
+            self._evict()
+
+    @contextmanager
+    def dataset(self, filepath):
+        """
+        with块内固定并返回文件句柄，退出with块时取消固定（不关闭文件，供之后复用）
+        :param filepath: str | PosixPath
+        :return:
+            netCDF4.Dataset
+        """
+        dataset = self.pin(filepath)
+        try:
+            yield dataset
+        finally:
+            self.unpin(filepath)
+
+    def close(self, filepath):
+        """
+        关闭单个文件（如文件将被其它程序改写）
+        :param filepath: str | PosixPath
+        :return: None
+        """
+        with self._lock:
+            key = self._key(filepath)
+            if key in self._datasets:
+                self._close_key(key)
+            self._pins.pop(key, None)
+
+    def close_all(self):
+        """
+        关闭所有文件
+        :return: None
+        """
+        with self._lock:
+            for key in list(self._datasets):
+                self._close_key(key)
+            self._pins.clear()
+
+    def metrics(self):
+        """
+        :return:
+            dict, 'open', 'pinned', 'max_open', 'hits', 'misses', 'evictions'
+        """
+        with self._lock:
+            return {'open': len(self._datasets), 'pinned': len(self._pins), 'max_open': self.max_open,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def _reset_after_fork(self):
+        # 子进程（如ProcessPoolExecutor的工作进程）不复用父进程打开的句柄
+        self._datasets = OrderedDict()
+        self._pins = {}
+        self._lock = threading.RLock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close_all()
+
+
+DATASET_POOL = DatasetPool(max_open=32)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=DATASET_POOL._reset_after_fork)
@@ -7,6 +7,14 @@ introduce:
         输出存放目录默认为 "./Results/CHRTOUT_output_figs/"
     （3）读取WRF-Hydro的多个输出文件（如202402010000.CHRTOUT_DOMAIN1）并提取streamflow变量到csv文件中
         输出文件路径默认为 "./Results/CHRTOUT streamflow output time series.csv"
+    （4）读取WRF-Hydro的多个输出文件并将streamflow变量保存为分块压缩的NetCDF4文件（time × feature_id，float32）
+        输出文件路径默认为 "./Results/CHRTOUT streamflow output time series.nc"
+    （5）批量读取WRF-Hydro的多个输出文件绘制河道流量专题地图并直接保存为动画（gif，或通过ffmpeg保存为mp4）
+        输出文件路径默认为 "./Results/CHRTOUT_streamflow.gif"
+    （6）跟踪模式：WRF-Hydro运行过程中轮询输出目录，只对新写入完成的输出文件绘制专题地图并追加写入（3）中的csv文件，
+        已处理的文件记录在csv文件旁的 "./Results/CHRTOUT follow checkpoint.json" 中
+    （7）读取WRF-Hydro的多个输出文件，一次遍历计算每个河段的流量统计量（均值、标准差、最大值及其出现时间、总径流量、分位数）
+        输出文件路径默认为 "./Results/CHRTOUT reach statistics.csv"
 
 parameter:
     dirpath: str
@@ -16,7 +24,11 @@ parameter:
     type: int
         1:  实现introduce中的功能（1）
         2： 实现introduce中的功能（2）,default
-        3： 实现introduce中的功能（2）
+        3： 实现introduce中的功能（3）
+        4： 实现introduce中的功能（4）
+        5： 实现introduce中的功能（5）
+        6： 实现introduce中的功能（6）
+        7： 实现introduce中的功能（7）
     SHAPEFILEPATH: str,
         自定义研究区域的shapefile文件存放路径
 
@@ -24,9 +36,11 @@ usage:
     main(type=2)
 """
 import os, sys, platform
+import subprocess
 import pathlib
 import shutil
 import netCDF4 as nc
+import matplotlib
 import matplotlib.pyplot as plt
 from mpl_toolkits.basemap import Basemap
 import numpy as np
@@ -34,14 +48,20 @@ import shapefile
 from pathlib import Path, PosixPath
 from datetime import datetime
 import csv
+import json
+import time
 from PIL import Image
 import math
 import tqdm
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from nc_handle_pool import DATASET_POOL
 
 type = 3
 SHAPEFILEPATH = r"./Data/USA_shp/jiazhou_merge.shp"
 dirpath = r"./Data/CHRTOUT_files"
 filepath = r'./Data/CHRTOUT_files/202402010100.CHRTOUT_DOMAIN1'
+CHRTOUT_INDEX_CACHE_DIR = r'./Results/CHRTOUT_index_cache'
 
 def get_platform_name():
     """
@@ -59,6 +79,7 @@ def get_platform_name():
         sys.exit()
 
 CURRENT_PLATFORM = get_platform_name()
+_WORKER_RENDERER = None
 
 def get_filenames(dirname:str, suffix):
     '''
@@ -113,7 +134,152 @@ def concat_images_grid(image_paths, ncols):
 
     return new_im
 
-def plot_streamflow_map(filepath, output_type='show'):
+def concat_images_grid_streaming(image_paths, ncols, savepath, tile_size=(200, 150), rows_per_page=20):
+    """
+    拼接多张图片为一张或多张图片（分页），每次只打开一张图片并缩小为tile_size，
+    每页拼接完成后立即保存，峰值内存只与单页大小有关，与图片数量无关
+    :param image_paths: list[str] | list[PosixPath]
+        图片路径列表
+    :param ncols: int
+        拼接后的图片每行的张数
+    :param savepath: str | PosixPath
+        拼接图保存路径，超过一页时按页保存为 文件名_page001.jpg、文件名_page002.jpg ...
+    :param tile_size: tuple, (width, height)
+        每张图片缩小后的最大尺寸，保持长宽比
+    :param rows_per_page: int
+        每页的行数
+    :return:
+        list[PosixPath], 保存的拼接图路径
+    """
+    savepath = Path(savepath)
+    tile_width, tile_height = tile_size
+    images_per_page = ncols * rows_per_page
+    num_pages = math.ceil(len(image_paths) / images_per_page)
+    saved_paths = []
+    for page in range(num_pages):
+        page_paths = image_paths[page * images_per_page:(page + 1) * images_per_page]
+        num_rows = math.ceil(len(page_paths) / ncols)
+        new_im = Image.new('RGB', (ncols * tile_width, num_rows * tile_height))
+        for index, img_path in enumerate(page_paths):
+            with Image.open(img_path) as im:
+                im.thumbnail(tile_size)
+                row = index // ncols
+                col = index % ncols
+                new_im.paste(im.convert('RGB'), (col * tile_width, row * tile_height))
+        if num_pages == 1:
+            page_savepath = savepath
+        else:
+            page_savepath = savepath.with_name(f'{savepath.stem}_page{page + 1:03d}{savepath.suffix}')
+        new_im.save(page_savepath)
+        new_im.close()
+        saved_paths.append(page_savepath)
+    return saved_paths
+
+class StreamflowMapRenderer:
+    """
+    河道流量专题地图绘图器
+    投影、海岸线、国界、河流和研究区域边界只绘制一次并缓存为背景图像，
+    之后每个时刻只更新散点的大小、颜色、色标和标题，并绘制在缓存的背景上
+    :param longitude: np.ndarray, 河段经度
+    :param latitude: np.ndarray, 河段纬度
+    :param shapefile_path: str, 研究区域的shapefile文件路径
+    """
+
+    def __init__(self, longitude, latitude, shapefile_path=None):
+        if shapefile_path is None:
+            shapefile_path = SHAPEFILEPATH
+        self.fig, self.ax = plt.subplots(figsize=(8, 6))
+        self.m = Basemap(projection="cyl", llcrnrlat=min(latitude), urcrnrlat=max(latitude),
+                         llcrnrlon=min(longitude), urcrnrlon=max(longitude), resolution='i', ax=self.ax)
+        self.m.drawcoastlines()
+        self.m.drawcountries()
+        self.m.drawrivers(color='blue')
+
+        x, y = self.m(longitude, latitude)
+        self.scatter = self.m.scatter(x, y, s=np.zeros(len(x)), c=np.zeros(len(x)), cmap='jet',
+                                      linewidth=0.5, alpha=0.5, edgecolors='k')
+        self.cbar = self.m.colorbar(self.scatter, location='right', pad='5%')
+        self.cbar.set_label('Stramflow')
+
+        sf = shapefile.Reader(shapefile_path)
+        for shape_rec in sf.shapeRecords():
+            shape = shape_rec.shape
+            points = shape.points
+            parts = list(shape.parts) + [len(points)]
+            for i in range(len(parts) - 1):
+                segment = points[parts[i]:parts[i + 1]]
+                lngs, lats = zip(*segment)
+                x, y = self.m(lngs, lats)
+                self.m.plot(x, y, marker=None, color='red')
+
+        self.title = self.ax.set_title(' ')
+        # 每个时刻变化的图形元素，不包含在缓存的背景中
+        self.frame_artists = [self.scatter, self.title, self.cbar.ax]
+        self.background = None
+
+    def update(self, streamflow, Date):
+        """
+        更新散点的大小、颜色、色标范围和标题
+        :param streamflow: np.ndarray
+        :param Date: str, 如202402010000
+        """
+        streamflow = np.ma.asarray(streamflow)
+        self.scatter.set_sizes(np.ma.filled(streamflow / streamflow.max() * 100, 0))
+        self.scatter.set_array(streamflow)
+        self.scatter.set_clim(streamflow.min(), streamflow.max())
+        self.title.set_text(f'{Date} Streamflow Map(WGS84 Coordinate System)')
+
+    def render(self):
+        """
+        将当前时刻绘制在缓存的背景上（第一次调用时绘制并缓存背景）
+        :return:
+            np.ndarray(3-D, RGBA)
+        """
+        canvas = self.fig.canvas
+        if self.background is None:
+            # 标题隐藏时其位置会被错误计算，因此绘制背景时改为清空标题文字
+            title_text = self.title.get_text()
+            self.title.set_text('')
+            for artist in (self.scatter, self.cbar.ax):
+                artist.set_visible(False)
+            canvas.draw()
+            self.background = canvas.copy_from_bbox(self.fig.bbox)
+            self.title.set_text(title_text)
+            for artist in (self.scatter, self.cbar.ax):
+                artist.set_visible(True)
+        canvas.restore_region(self.background)
+        for artist in self.frame_artists:
+            self.fig.draw_artist(artist)
+        return np.asarray(canvas.buffer_rgba())
+
+    def save(self, fig_savepath):
+        """
+        保存当前时刻的专题地图
+        :param fig_savepath: str | PosixPath
+        """
+        Image.fromarray(self.render()).convert('RGB').save(fig_savepath)
+
+    def close(self):
+        plt.close(self.fig)
+
+def get_streamflow_map_savepath(Date):
+    """
+    专题地图的保存路径，如"./Results/CHRTOUT_output_figs/202402010000_CHRTOUT.png"
+    :param Date: str
+    :return:
+        PosixPath | str
+    """
+    if CURRENT_PLATFORM == "linux":
+        fig_savedir = PosixPath(r"./Results").joinpath('CHRTOUT_output_figs')
+        filename = Date + '_CHRTOUT' + '.png'
+        fig_savepath = fig_savedir.joinpath(PosixPath(filename))
+    elif CURRENT_PLATFORM == 'windows':
+        fig_savedir = os.path.join(os.path.abspath(r"./Results"), 'CHRTOUT_output_figs')
+        filename = Date + '_CHRTOUT' + '.png'
+        fig_savepath = os.path.join(fig_savedir, filename)
+    return fig_savepath
+
+def plot_streamflow_map(filepath, output_type='show', renderer=None):
     """
     读取文件中的longitude, latitude, streamflow三个变量并绘制河道流量专题地图，
     数据来源WRF-Hydro输出文件，如"202402092200.CHRTOUT_DOMAIN1"
@@ -122,126 +288,705 @@ def plot_streamflow_map(filepath, output_type='show'):
     :param output_type: str
         'show'：仅显示不保存
         'save'：保存但不显示
+    :param renderer: StreamflowMapRenderer | None
+        批量绘图时重复使用的绘图器（同一河网），为None时新建绘图器，保存后关闭
     :return: None
     """
 
-    dataset = nc.Dataset(filepath)
-    longitude = dataset.variables['longitude'][:]
-    latitude = dataset.variables['latitude'][:]
-    streamflow = dataset.variables['streamflow'][:]
-
-    fig, ax = plt.subplots(figsize=(8, 6))
-
-    m = Basemap(projection="cyl", llcrnrlat=min(latitude), urcrnrlat=max(latitude),
-                llcrnrlon=min(longitude), urcrnrlon=max(longitude), resolution='i')
-
-    m.drawcoastlines()
-    m.drawcountries()
-    m.drawrivers(color='blue')
-
-    x, y = m(longitude, latitude)
-    size = np.array(streamflow) / max(streamflow) * 100
-    scatter = m.scatter(x, y, s=size, c=streamflow, cmap='jet', linewidth=0.5, alpha=0.5, edgecolors='k')
-    cbar = m.colorbar(scatter, location='right', pad='5%')
-    cbar.set_label('Stramflow')
-
-    shpfile_path = SHAPEFILEPATH
-    sf = shapefile.Reader(shpfile_path)
-
-    for shape_rec in sf.shapeRecords():
-        shape = shape_rec.shape
-        points = shape.points
-        parts = list(shape.parts) + [len(points)]
-        for i in range(len(parts) - 1):
-            segment = points[parts[i]:parts[i + 1]]
-            lngs, lats = zip(*segment)
-            x, y = m(lngs, lats)
-            m.plot(x, y, marker=None, color='red')
+    with DATASET_POOL.dataset(filepath) as dataset:
+        longitude = dataset.variables['longitude'][:]
+        latitude = dataset.variables['latitude'][:]
+        streamflow = dataset.variables['streamflow'][:]
 
+    own_renderer = renderer is None
+    if own_renderer:
+        renderer = StreamflowMapRenderer(longitude, latitude)
 
     if CURRENT_PLATFORM == "linux":
         Date = PosixPath(filepath).resolve().parts[-1].split('.')[0]
     elif CURRENT_PLATFORM == 'windows':
         abspath = os.path.abspath(filepath)
         Date = abspath.split("\\")[-1].split(".")[0]
-    plt.title(f'{Date} Streamflow Map(WGS84 Coordinate System)')
+    renderer.update(streamflow, Date)
 
     if output_type == 'show':
         plt.show()
     elif output_type == "save":
-        if CURRENT_PLATFORM == "linux":
-            fig_savedir = PosixPath(r"./Results").joinpath('CHRTOUT_output_figs')
-            filename = Date + '_CHRTOUT' + '.png'
-            fig_savepath = fig_savedir.joinpath(PosixPath(filename))
-        elif CURRENT_PLATFORM == 'windows':
-            fig_savedir = os.path.join(os.path.abspath(r"./Results"), 'CHRTOUT_output_figs')
-            filename = Date + '_CHRTOUT' + '.png'
-            fig_savepath = os.path.join(fig_savedir, filename)
-        plt.savefig(fig_savepath)
-        plt.clf()
-
-def read_CHRTOUT_streamflow_save_multi_fig(data_dir:str):
+        renderer.save(get_streamflow_map_savepath(Date))
+        if own_renderer:
+            renderer.close()
 
-    filepaths, _ = get_filenames(data_dir, suffix='.CHRTOUT_DOMAIN1')
+def _init_render_worker():
+    """
+    并行绘图子进程的初始化函数，使用非交互式的Agg后端
+    """
+    matplotlib.use('Agg')
+
+def _save_streamflow_map(filepath):
+    """
+    并行绘图时子进程执行的任务，每个子进程使用自己的figure和绘图器
+    :param filepath: str | PosixPath
+    """
+    global _WORKER_RENDERER
+    if _WORKER_RENDERER is None:
+        with DATASET_POOL.dataset(filepath) as dataset:
+            _WORKER_RENDERER = StreamflowMapRenderer(dataset.variables['longitude'][:],
+                                                     dataset.variables['latitude'][:])
+    plot_streamflow_map(filepath, output_type='save', renderer=_WORKER_RENDERER)
+
+def get_CHRTOUT_fig_savedir():
+    """
+    河道流量专题地图的输出目录
+    :return: str
+    """
     if CURRENT_PLATFORM == "linux":
         fig_savedir = str(PosixPath(r"./Results").joinpath('CHRTOUT_output_figs')    )         # PosixPath -> str
     elif CURRENT_PLATFORM == 'windows':
         fig_savedir = os.path.join(os.path.abspath(r"./Results"), 'CHRTOUT_output_figs')  # str
-    if os.path.exists(fig_savedir):
+    return fig_savedir
+
+def read_CHRTOUT_streamflow_save_multi_fig(data_dir:str, workers=1, clean=True):
+    """
+    批量绘制CHRTOUT文件的河道流量专题地图并保存，最后输出一张全部专题地图的拼接图
+    :param data_dir: str
+        CHRTOUT文件存放目录
+    :param workers: int
+        绘图进程数，大于1时多个进程（Agg后端）并行绘图，输出文件名由文件时间确定，与绘图顺序无关
+    :param clean: bool
+        True时先清空输出目录，False时保留输出目录中已有的专题地图（同名文件被覆盖）
+    :return: None
+    """
+    filepaths, _ = get_filenames(data_dir, suffix='.CHRTOUT_DOMAIN1')
+    fig_savedir = get_CHRTOUT_fig_savedir()
+    if clean and os.path.exists(fig_savedir):
         shutil.rmtree(fig_savedir)
-    os.mkdir(fig_savedir)
-    for filepath in tqdm.tqdm(filepaths, ncols=80, desc="plot streamflow progress"):
-        plot_streamflow_map(filepath, output_type='save')
+    os.makedirs(fig_savedir, exist_ok=True)
+    if workers <= 1:
+        renderer = None
+        for filepath in tqdm.tqdm(filepaths, ncols=80, desc="plot streamflow progress"):
+            if renderer is None:
+                with DATASET_POOL.dataset(filepath) as dataset:
+                    renderer = StreamflowMapRenderer(dataset.variables['longitude'][:],
+                                                     dataset.variables['latitude'][:])
+            plot_streamflow_map(filepath, output_type='save', renderer=renderer)
+        if renderer is not None:
+            renderer.close()
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker) as executor:
+            chunksize = max(1, len(filepaths) // (workers * 4))
+            for _ in tqdm.tqdm(executor.map(_save_streamflow_map, filepaths, chunksize=chunksize),
+                               total=len(filepaths), ncols=80, desc="plot streamflow progress"):
+                pass
 
     image_paths, _ = get_filenames(fig_savedir, '.png')
     imagepath_list = [str(imagepath) for imagepath in image_paths]
-    result_image = concat_images_grid(imagepath_list, 12)
-    result_image.save(fig_savedir + '/concat_image.jpg')
+    concat_images_grid_streaming(imagepath_list, 12, fig_savedir + '/concat_image.jpg')
+
+def save_streamflow_animation(data_dir:str, savepath=None, fps=5):
+    """
+    将多个CHRTOUT文件的河道流量专题地图直接保存为动画，所有帧共用缓存的背景，
+    每帧从画布缓冲区直接送入编码器，不保存中间的png文件
+        .gif / .png(APNG): 使用Pillow编码，编码器需要保留所有帧（调色板图像），适合帧数不多的动画
+        .mp4等其它格式: 通过管道送入ffmpeg（需要安装ffmpeg，路径可通过matplotlib.rcParams['animation.ffmpeg_path']设置），
+            内存占用与帧数无关
+    :param data_dir: str
+        CHRTOUT文件存放目录
+    :param savepath: str | PosixPath | None
+        为None时保存为"./Results/CHRTOUT_streamflow.gif"
+    :param fps: int | float, 每秒帧数
+    :return: None
+    """
+    filepaths, _ = get_filenames(data_dir, suffix='.CHRTOUT_DOMAIN1')
+    if len(filepaths) == 0:
+        raise FileNotFoundError(f"no .CHRTOUT_DOMAIN1 file in {data_dir}")
+    if savepath is None:
+        savepath = os.path.join(os.path.abspath(r"./Results"), 'CHRTOUT_streamflow.gif')
+    suffix = Path(savepath).suffix.lower()
+    with DATASET_POOL.dataset(filepaths[0]) as dataset:
+        renderer = StreamflowMapRenderer(dataset.variables['longitude'][:], dataset.variables['latitude'][:])
+
+    def iter_frames():
+        for filepath in tqdm.tqdm(filepaths, ncols=80, desc="animation progress"):
+            with DATASET_POOL.dataset(filepath) as dataset:
+                streamflow = dataset.variables['streamflow'][:]
+            renderer.update(streamflow, Path(filepath).name.split('.')[0])
+            yield renderer.render()
+
+    try:
+        if suffix in ('.gif', '.png', '.apng'):
+            if suffix == '.gif':
+                images = (Image.fromarray(frame).convert('RGB').quantize() for frame in iter_frames())
+            else:
+                images = (Image.fromarray(frame).convert('RGB') for frame in iter_frames())
+            first_image = next(images)
+            first_image.save(savepath, save_all=True, append_images=images, duration=int(1000 / fps), loop=0)
+        else:
+            ffmpeg_path = shutil.which(matplotlib.rcParams['animation.ffmpeg_path'])
+            if ffmpeg_path is None:
+                raise RuntimeError("ffmpeg not found, install ffmpeg or save as .gif")
+            frames = iter_frames()
+            first_frame = next(frames)
+            height, width = first_frame.shape[:2]
+            cmd = [ffmpeg_path, '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+                   '-vcodec', 'libx264', '-pix_fmt', 'yuv420p', str(savepath)]
+            with subprocess.Popen(cmd, stdin=subprocess.PIPE) as process:
+                process.stdin.write(first_frame.tobytes())
+                for frame in frames:
+                    process.stdin.write(frame.tobytes())
+                process.stdin.close()
+                if process.wait() != 0:
+                    raise RuntimeError(f"ffmpeg failed to write {savepath}")
+    finally:
+        renderer.close()
+    print(f'save finished! {savepath}')
+
+def get_CHRTOUT_time(filepath):
+    """
+    从CHRTOUT文件名（如202402010000.CHRTOUT_DOMAIN1）中解析时间
+    :param filepath: str | PosixPath
+    :return:
+        datetime
+    """
+    stem = Path(filepath).stem
+    YYYY, MM, DD, HH, mm, ss = stem[0:4], stem[4:6], stem[6:8], stem[8:10], stem[10:12], '00'
+    time_str = f'{YYYY}-{MM}-{DD} {HH}:{mm}:{ss}'
+    return datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S')
+
+def get_CHRTOUT_csv_savepath():
+    """
+    streamflow时间序列csv文件的输出路径
+    :return: PosixPath | str
+    """
+    if CURRENT_PLATFORM == "linux":
+        savepath = PosixPath(r"./Results").resolve().joinpath('CHRTOUT streamflow output time series.csv')
+    elif CURRENT_PLATFORM == 'windows':
+        savepath = os.path.join(os.path.abspath(r"./Results"), 'CHRTOUT streamflow output time series.csv')  # str
+    return savepath
+
+def write_CHRTOUT_streamflow_row(writer, filepath, write_lonlat=False):
+    """
+    将单个CHRTOUT文件的streamflow写入csv的一行
+    :param writer: csv.writer
+    :param filepath: str | PosixPath
+    :param write_lonlat: bool
+        True时先写入经度、纬度两行（csv文件的表头）
+    :return: None
+    """
+    with DATASET_POOL.dataset(filepath) as dataset:
+        dataset.set_auto_mask(False)
+        if write_lonlat:
+            writer.writerow(['lon'] + list(dataset.variables['longitude'][:]))
+            writer.writerow(['lat'] + list(dataset.variables['latitude'][:]))
+        streamflow = dataset.variables['streamflow'][:]
+    writer.writerow([get_CHRTOUT_time(filepath)] + streamflow.tolist())
 
 def time_series_CHRTOUT_streamflow_to_csv(CHRTOUT_dirpath:str):
     """
     读取所有wrf-hydro输出CHRTOUT文件中的lon，lat、streamflow数据和对应的时间，并输出为csv文件
+    先根据第一个文件写入经度、纬度两行，之后每读取一个文件写入一行，内存占用与文件数量无关
     :param CHRTOUT_dirpath:
     :return: 输出csv文件格式
     每一行代表一个时间点的streamflow数据，文件第一行为经度，第二行为纬度，第一列为时间，中间为数据
     """
     file_paths, _ = get_filenames(CHRTOUT_dirpath, suffix='.CHRTOUT_DOMAIN1')
-    n_file = len(file_paths)
-    count = 0
-    # 读取变量并保存为二维数组，一行代表一个时间点，并读取时间，保存为lons，lats，stfs，t
-    for filename in file_paths:
-        dataset = nc.Dataset(filename)
-        longitude = np.atleast_2d(dataset.variables['longitude'][:])
-        latitude = np.atleast_2d(dataset.variables['latitude'][:])
-        streamflow = np.atleast_2d(dataset.variables['streamflow'][:])
-        YYYY, MM, DD, HH, mm, ss = filename.stem[0:4], filename.stem[4:6], filename.stem[6:8], filename.stem[8:10], filename.stem[10:], '00'
-        time_str = f'{YYYY}-{MM}-{DD} {HH}:{mm}:{ss}'
-        time = np.atleast_2d(datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S'))
-        if count == 0:
-            lons = longitude
-            lats = latitude
-            stfs = streamflow
-            t = time
-            count = count + 1
-        else:
-            lons = np.vstack((lons, longitude))
-            lats = np.vstack((lats, latitude))
-            stfs = np.vstack((stfs, streamflow))
-            t = np.vstack((t, time))
-            count = count + 1
-    output_data = np.hstack((t, stfs))
-    output_data = np.vstack((np.hstack((np.atleast_2d('lat'), latitude)), output_data))
-    output_data = np.vstack((np.hstack((np.atleast_2d('lon'), longitude)), output_data))
-    if CURRENT_PLATFORM == "linux":
-        savepath = PosixPath(r"./Results").resolve().joinpath('CHRTOUT streamflow output time series.csv')
-    elif CURRENT_PLATFORM == 'windows':
-        savepath = os.path.join(os.path.abspath(r"./Results"), 'CHRTOUT streamflow output time series.csv')  # str
+    savepath = get_CHRTOUT_csv_savepath()
     with open(savepath, 'w', newline="") as f:
         writer = csv.writer(f)
-        writer.writerows(output_data)
+        for count, filename in enumerate(file_paths):
+            write_CHRTOUT_streamflow_row(writer, filename, write_lonlat=(count == 0))
     print('save finished! CHRTOUT streamflow output time series.csv ---> ./Results')
 
 
+def load_CHRTOUT_checkpoint(checkpoint_path):
+    """
+    读取跟踪模式的检查点文件，检查点中记录已处理的CHRTOUT文件时间（如202402010000）
+    :param checkpoint_path: str | PosixPath
+    :return:
+        set[str]
+    """
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, 'r') as f:
+        return set(json.load(f)['processed'])
+
+def save_CHRTOUT_checkpoint(checkpoint_path, processed):
+    """
+    保存跟踪模式的检查点文件，先写入临时文件再替换，中断时不会留下不完整的检查点
+    :param checkpoint_path: str | PosixPath
+    :param processed: set[str]
+    :return: None
+    """
+    tmp_path = str(checkpoint_path) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'processed': sorted(processed)}, f, indent=1)
+    os.replace(tmp_path, checkpoint_path)
+
+def read_CHRTOUT_csv_times(csv_savepath):
+    """
+    读取streamflow时间序列csv文件中已写入的时间（第一列，跳过经度、纬度两行），只解析每行的第一个字段
+    :param csv_savepath: str | PosixPath
+    :return:
+        set[str]，csv文件不存在时为空集合
+    """
+    if not os.path.exists(csv_savepath):
+        return set()
+    with open(csv_savepath, 'r') as f:
+        return {line.split(',', 1)[0] for line in f if not line.startswith(('lon,', 'lat,')) and line.strip()}
+
+def get_completed_CHRTOUT_files(data_dir, last_sizes):
+    """
+    查找已写入完成的CHRTOUT文件：文件大小与上一次轮询时相同（且不为0）时认为WRF-Hydro已写完该文件
+    :param data_dir: str
+    :param last_sizes: dict[str, int]
+        上一次轮询时各文件的大小，函数内更新为本次轮询的大小
+    :return:
+        list[PosixPath]，按文件时间排序
+    """
+    filepaths, _ = get_filenames(data_dir, suffix='.CHRTOUT_DOMAIN1')
+    completed = []
+    for filepath in filepaths:
+        size = os.path.getsize(filepath)
+        if size > 0 and last_sizes.get(str(filepath)) == size:
+            completed.append(filepath)
+        last_sizes[str(filepath)] = size
+    return sorted(completed, key=lambda path: Path(path).name)
+
+def reconcile_CHRTOUT_checkpoint(data_dir, csv_savepath, processed):
+    """
+    跟踪模式启动时使检查点与csv文件一致（csv文件写入一行后、检查点保存前被中断时两者不一致）：
+        删除csv文件末尾未写完的行；
+        csv中已有、检查点中没有的时间，若data_dir中有对应的CHRTOUT文件则补记到检查点中；
+        检查点中有、csv中没有的时间从检查点中删除，之后重新处理
+    :param data_dir: str
+    :param csv_savepath: str | PosixPath
+    :param processed: set[str], 检查点中的记录，函数内原地更新
+    :return:
+        bool，检查点是否被修改
+    """
+    if os.path.exists(csv_savepath):
+        with open(csv_savepath, 'rb+') as f:
+            content = f.read()
+            if content and not content.endswith(b'\n'):
+                f.truncate(content.rfind(b'\n') + 1)
+    csv_times = read_CHRTOUT_csv_times(csv_savepath)
+    checkpoint_stems = {str(get_CHRTOUT_time(stem)): stem for stem in processed}
+    file_paths, _ = get_filenames(data_dir, suffix='.CHRTOUT_DOMAIN1')
+    file_stems = {str(get_CHRTOUT_time(filepath)): Path(filepath).name.split('.')[0] for filepath in file_paths}
+    unknown = sorted(csv_time for csv_time in csv_times
+                     if csv_time not in checkpoint_stems and csv_time not in file_stems)
+    if unknown:
+        raise ValueError(f"{csv_savepath} holds {len(unknown)} time steps never processed from {data_dir} "
+                         f"(e.g. {unknown[0]}), remove it and the checkpoint before following.")
+    changed = False
+    for csv_time in csv_times - checkpoint_stems.keys():
+        processed.add(file_stems[csv_time])
+        changed = True
+    for checkpoint_time in checkpoint_stems.keys() - csv_times:
+        processed.discard(checkpoint_stems[checkpoint_time])
+        changed = True
+    return changed
+
+def follow_CHRTOUT_run(data_dir:str, interval=60, max_polls=None, checkpoint_path=None):
+    """
+    跟踪模式：WRF-Hydro运行过程中轮询输出目录，只处理新写入完成的CHRTOUT文件，
+    绘制其河道流量专题地图并追加写入streamflow时间序列csv文件，不重新处理已处理过的文件，
+    跟踪结束时生成一次全部专题地图的拼接图
+    已处理的文件时间记录在检查点文件中，中断后再次运行时从检查点继续
+    :param data_dir: str
+        CHRTOUT文件存放目录（WRF-Hydro的运行目录）
+    :param interval: int | float
+        两次轮询的间隔（秒），文件需要在两次轮询之间大小不变才会被处理
+    :param max_polls: int | None
+        最多轮询次数，为None时一直运行（Ctrl+C结束）
+    :param checkpoint_path: str | PosixPath | None
+        检查点文件路径，为None时为csv文件所在目录下的"CHRTOUT follow checkpoint.json"，
+        不放在专题地图输出目录中（该目录会被read_CHRTOUT_streamflow_save_multi_fig清空，而csv文件不会）
+        启动时先使检查点与csv文件一致（见reconcile_CHRTOUT_checkpoint），csv文件中有未处理过的时间时报错，避免重复追加
+    :return: None
+    """
+    fig_savedir = get_CHRTOUT_fig_savedir()
+    os.makedirs(fig_savedir, exist_ok=True)
+    csv_savepath = get_CHRTOUT_csv_savepath()
+    if checkpoint_path is None:
+        checkpoint_path = os.path.join(os.path.dirname(csv_savepath), 'CHRTOUT follow checkpoint.json')
+    processed = load_CHRTOUT_checkpoint(checkpoint_path)
+    if reconcile_CHRTOUT_checkpoint(data_dir, csv_savepath, processed):
+        save_CHRTOUT_checkpoint(checkpoint_path, processed)
+    last_sizes = {}
+    renderer = None
+    polls, n_new = 0, 0
+    try:
+        while max_polls is None or polls < max_polls:
+            if polls > 0:
+                time.sleep(interval)
+            polls += 1
+            new_files = [filepath for filepath in get_completed_CHRTOUT_files(data_dir, last_sizes)
+                         if Path(filepath).name.split('.')[0] not in processed]
+            if len(new_files) == 0:
+                continue
+            write_lonlat = not os.path.exists(csv_savepath)
+            with open(csv_savepath, 'a', newline="") as f:
+                writer = csv.writer(f)
+                for filepath in new_files:
+                    if renderer is None:
+                        with DATASET_POOL.dataset(filepath) as dataset:
+                            renderer = StreamflowMapRenderer(dataset.variables['longitude'][:],
+                                                             dataset.variables['latitude'][:])
+                    plot_streamflow_map(filepath, output_type='save', renderer=renderer)
+                    write_CHRTOUT_streamflow_row(writer, filepath, write_lonlat=write_lonlat)
+                    write_lonlat = False
+                    f.flush()
+                    processed.add(Path(filepath).name.split('.')[0])
+                    save_CHRTOUT_checkpoint(checkpoint_path, processed)
+            n_new += len(new_files)
+            print(f'{datetime.now():%Y-%m-%d %H:%M:%S} processed {len(new_files)} new CHRTOUT files, '
+                  f'{len(processed)} in total')
+    finally:
+        if renderer is not None:
+            renderer.close()
+        # 拼接图只在跟踪结束（达到max_polls或Ctrl+C）时生成一次，不在每次轮询时重新拼接所有专题地图
+        if n_new > 0:
+            image_paths, _ = get_filenames(fig_savedir, '.png')
+            concat_images_grid_streaming([str(imagepath) for imagepath in image_paths], 12,
+                                         fig_savedir + '/concat_image.jpg')
+
+def time_series_CHRTOUT_streamflow_to_netcdf(CHRTOUT_dirpath:str, savepath=None, time_chunk=24, feature_chunk=4096):
+    """
+    读取所有wrf-hydro输出CHRTOUT文件中的streamflow数据，逐个文件写入分块压缩的NetCDF4文件
+    文件结构：
+        dimensions: time(unlimited), feature_id
+        time(time): int32，单位与CHRTOUT文件相同（minutes since 1970-01-01 00:00:00 UTC）
+        feature_id(feature_id), longitude(feature_id), latitude(feature_id): 只保存一次
+        streamflow(time, feature_id): float32，zlib压缩，分块大小为(time_chunk, feature_chunk)，
+            读取单个河段或单个时刻时只需解压相关的分块
+    :param CHRTOUT_dirpath:
+    :param savepath: str | PosixPath | None
+        为None时保存为"./Results/CHRTOUT streamflow output time series.nc"
+    :param time_chunk: int
+    :param feature_chunk: int
+    :return: None
+    """
+    file_paths, _ = get_filenames(CHRTOUT_dirpath, suffix='.CHRTOUT_DOMAIN1')
+    if len(file_paths) == 0:
+        raise FileNotFoundError(f"no .CHRTOUT_DOMAIN1 file in {CHRTOUT_dirpath}")
+    if savepath is None:
+        savepath = os.path.join(os.path.abspath(r"./Results"), 'CHRTOUT streamflow output time series.nc')
+    DATASET_POOL.close(savepath)
+    with nc.Dataset(savepath, 'w', format='NETCDF4') as store:
+        for count, filename in enumerate(file_paths):
+            with DATASET_POOL.dataset(filename) as dataset:
+                # time不一定在valid_min、valid_max之内，只对streamflow掩膜
+                dataset.set_auto_mask(False)
+                dataset.variables['streamflow'].set_auto_mask(True)
+                if count == 0:
+                    n_feature = len(dataset.dimensions['feature_id'])
+                    store.createDimension('time', None)
+                    store.createDimension('feature_id', n_feature)
+                    time_var = store.createVariable('time', 'i4', ('time',))
+                    time_var.units = dataset.variables['time'].units
+                    time_var.long_name = 'valid output time'
+                    for varname in ('feature_id', 'longitude', 'latitude'):
+                        var = store.createVariable(varname, dataset.variables[varname].dtype, ('feature_id',), zlib=True)
+                        var.setncatts({k: dataset.variables[varname].getncattr(k)
+                                       for k in dataset.variables[varname].ncattrs() if k != '_FillValue'})
+                        var[:] = dataset.variables[varname][:]
+                    # 保存的是解包后的float32，_FillValue、missing_value和valid_range换算为物理单位
+                    source = dataset.variables['streamflow']
+                    scale_factor = getattr(source, 'scale_factor', 1.0)
+                    add_offset = getattr(source, 'add_offset', 0.0)
+                    fill_value = np.float32(getattr(source, '_FillValue', -9999.0) if source.dtype.kind == 'f'
+                                            else -9999.0)
+                    streamflow_var = store.createVariable('streamflow', 'f4', ('time', 'feature_id'), zlib=True,
+                                                          complevel=4, shuffle=True, fill_value=fill_value,
+                                                          chunksizes=(time_chunk, min(feature_chunk, n_feature)))
+                    attrs = {k: source.getncattr(k) for k in source.ncattrs()
+                             if k not in ('_FillValue', 'scale_factor', 'add_offset', 'grid_mapping')}
+                    attrs['missing_value'] = fill_value
+                    if 'valid_range' in attrs:
+                        attrs['valid_range'] = (np.asarray(attrs['valid_range']) * scale_factor
+                                                + add_offset).astype(np.float32)
+                    streamflow_var.setncatts(attrs)
+                time_var[count] = dataset.variables['time'][0]
+                # 掩膜数组写入时无效值保存为_FillValue
+                streamflow_var[count, :] = dataset.variables['streamflow'][:]
+    print(f'save finished! {savepath}')
+
+def read_CHRTOUT_streamflow_store(store_path, feature_ids=None, start_time=None, end_time=None):
+    """
+    读取time_series_CHRTOUT_streamflow_to_netcdf保存的NetCDF4文件中指定河段、指定时段的streamflow
+    :param store_path: str | PosixPath
+    :param feature_ids: list[int] | None
+        河段编号，为None时读取全部河段
+    :param start_time: datetime | None
+    :param end_time: datetime | None
+        读取start_time至end_time（包含）之间的时刻，为None时不限制
+    :return:
+        times: np.ndarray(1-D), datetime
+        feature_id: np.ndarray(1-D)
+        streamflow: np.ma.MaskedArray(2-D), (time, feature_id)，无效值（_FillValue、valid_range之外）被掩膜
+    """
+    with DATASET_POOL.dataset(store_path) as store:
+        store.set_auto_mask(False)
+        store.variables['streamflow'].set_auto_mask(True)
+        time_var = store.variables['time']
+        times = nc.num2date(time_var[:], time_var.units, only_use_cftime_datetimes=False,
+                            only_use_python_datetimes=True)
+        times = np.array(times)
+        time_mask = np.ones(len(times), dtype=bool)
+        if start_time is not None:
+            time_mask &= times >= start_time
+        if end_time is not None:
+            time_mask &= times <= end_time
+        time_index = np.flatnonzero(time_mask)
+        all_feature_id = store.variables['feature_id'][:]
+        if feature_ids is None:
+            feature_index = np.arange(len(all_feature_id))
+        else:
+            positions = {fid: i for i, fid in enumerate(all_feature_id.tolist())}
+            missing = [fid for fid in feature_ids if fid not in positions]
+            if missing:
+                raise KeyError(f"feature_id not found: {missing}")
+            feature_index = np.array([positions[fid] for fid in feature_ids], dtype=int)
+        if len(time_index) == 0:
+            streamflow = np.ma.empty((0, len(feature_index)), dtype=np.float32)
+        else:
+            # 只读取连续的时间范围和所需的河段列，只解压涉及的分块
+            streamflow_var = store.variables['streamflow']
+            t0, t1 = time_index[0], time_index[-1] + 1
+            if feature_ids is None:
+                streamflow = streamflow_var[t0:t1, :]
+            else:
+                streamflow = np.ma.stack([streamflow_var[t0:t1, i] for i in feature_index], axis=1)
+            streamflow = np.ma.asarray(streamflow)[time_index - t0]
+    return times[time_index], all_feature_id[feature_index], streamflow
+
+def get_CHRTOUT_feature_index(filepath, cache_dir=CHRTOUT_INDEX_CACHE_DIR):
+    """
+    获取河网的河段索引（feature_id、经纬度及其在CHRTOUT文件中的位置），同一河网只建立一次，
+    按feature_id的哈希值缓存在磁盘上
+    :param filepath: str | PosixPath
+        该河网任意一个CHRTOUT文件
+    :param cache_dir: str | PosixPath
+    :return:
+        dict
+            'feature_id', 'longitude', 'latitude': np.ndarray(1-D)，按文件中的位置排列
+            'order': np.ndarray(1-D)，feature_id从小到大排序后的位置，用于按feature_id查找
+    """
+    with DATASET_POOL.dataset(filepath) as dataset:
+        dataset.set_auto_mask(False)
+        feature_id = dataset.variables['feature_id'][:]
+        cache_path = Path(cache_dir).joinpath(f'{hashlib.sha1(feature_id.tobytes()).hexdigest()[:16]}.npz')
+        if cache_path.exists():
+            with np.load(cache_path) as cache:
+                return {key: cache[key] for key in cache.files}
+        feature_index = {'feature_id': feature_id,
+                         'longitude': dataset.variables['longitude'][:],
+                         'latitude': dataset.variables['latitude'][:],
+                         'order': np.argsort(feature_id, kind='stable')}
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez(cache_path, **feature_index)
+    return feature_index
+
+def locate_CHRTOUT_reaches(feature_index, feature_ids=None, lonlats=None):
+    """
+    根据feature_id或经纬度（取最近的河段）查找河段在CHRTOUT文件中的位置
+    :param feature_index: dict, get_CHRTOUT_feature_index的返回值
+    :param feature_ids: list[int] | None
+    :param lonlats: list[tuple] | None, [(lon, lat), ...]
+    :return:
+        positions: np.ndarray(1-D, int)
+    """
+    if (feature_ids is None) == (lonlats is None):
+        raise ValueError("provide exactly one of feature_ids and lonlats.")
+    if feature_ids is not None:
+        feature_ids = np.asarray(feature_ids)
+        sorted_id = feature_index['feature_id'][feature_index['order']]
+        rank = np.clip(np.searchsorted(sorted_id, feature_ids), 0, len(sorted_id) - 1)
+        missing = feature_ids[sorted_id[rank] != feature_ids]
+        if len(missing) > 0:
+            raise KeyError(f"feature_id not found: {missing.tolist()}")
+        return feature_index['order'][rank]
+    longitude = feature_index['longitude'].astype(np.float64)
+    latitude = feature_index['latitude'].astype(np.float64)
+    positions = []
+    for lon, lat in lonlats:
+        # 经度差按纬度缩放后计算平面距离，取距离最近的河段
+        dist = ((longitude - lon) * np.cos(np.deg2rad(lat))) ** 2 + (latitude - lat) ** 2
+        positions.append(int(np.argmin(dist)))
+    return np.array(positions, dtype=int)
+
+def _read_CHRTOUT_positions(args):
+    """
+    读取单个CHRTOUT文件中指定位置的变量值，只读取这些位置的数据
+    :param args: tuple, (filepath, sorted_positions, varname)
+    :return:
+        np.ndarray(1-D)
+    """
+    filepath, sorted_positions, varname = args
+    with DATASET_POOL.dataset(filepath) as dataset:
+        dataset.set_auto_mask(False)
+        return np.asarray(dataset.variables[varname][sorted_positions])
+
+def extract_CHRTOUT_hydrographs(CHRTOUT_dirpath:str, feature_ids=None, lonlats=None, varname='streamflow',
+                                workers=4, savepath=None):
+    """
+    提取指定河段（按feature_id或最近的经纬度）的流量过程线，每个CHRTOUT文件只读取这些河段的数据，多进程并行
+    :param CHRTOUT_dirpath:
+    :param feature_ids: list[int] | None
+    :param lonlats: list[tuple] | None, [(lon, lat), ...]
+    :param varname: str, 变量名，默认为'streamflow'
+    :param workers: int, 读取文件的进程数
+    :param savepath: str | PosixPath | None
+        提供时保存为csv文件，第一行为feature_id，第一列为时间，中间为数据
+    :return:
+        time_arr: np.ndarray(1-D)
+        reach_feature_id: np.ndarray(1-D)，与输入顺序一致
+        hydrographs: np.ndarray(2-D), (time, reach)
+    """
+    file_paths, _ = get_filenames(CHRTOUT_dirpath, suffix='.CHRTOUT_DOMAIN1')
+    if len(file_paths) == 0:
+        raise FileNotFoundError(f"no .CHRTOUT_DOMAIN1 file in {CHRTOUT_dirpath}")
+    feature_index = get_CHRTOUT_feature_index(file_paths[0])
+    positions = locate_CHRTOUT_reaches(feature_index, feature_ids, lonlats)
+    # 按位置排序并去重后读取，读取后再恢复输入顺序
+    sorted_positions, inverse = np.unique(positions, return_inverse=True)
+    tasks = [(filepath, sorted_positions, varname) for filepath in file_paths]
+    if workers <= 1:
+        values = [_read_CHRTOUT_positions(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            values = list(executor.map(_read_CHRTOUT_positions, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+    hydrographs = np.array(values)[:, inverse]
+    time_arr = np.array([get_CHRTOUT_time(filepath) for filepath in file_paths])
+    reach_feature_id = feature_index['feature_id'][positions]
+    if savepath is not None:
+        with open(savepath, 'w', newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(['feature_id'] + reach_feature_id.tolist())
+            for valid_time, row in zip(time_arr, hydrographs):
+                writer.writerow([valid_time] + row.tolist())
+        print(f'save finished! {savepath}')
+    return time_arr, reach_feature_id, hydrographs
+
+class ReachStatistics:
+    """
+    逐时刻更新的河段流量统计量（向量化，每个时刻更新所有河段），内存只与河段数量有关：
+        Welford算法计算均值和方差，逐时刻更新最大值及其出现的时刻，流量乘以时间步长累加得到总径流量，
+        对数间隔的直方图（每个河段一行计数）近似计算分位数
+    """
+    def __init__(self, n_reach, hist_min=1e-3, hist_max=1e5, n_bins=160):
+        """
+        :param n_reach: int, 河段数量
+        :param hist_min: float, 直方图最小边界（m3/s），小于该值的流量计入第一个区间（视为0）
+        :param hist_max: float, 直方图最大边界（m3/s），大于该值的流量计入最后一个区间
+        :param n_bins: int, 对数区间数量，分位数的相对误差约为 (hist_max/hist_min)**(1/n_bins) - 1（默认约12%）
+        """
+        self.count = np.zeros(n_reach, dtype=np.int64)
+        self.mean = np.zeros(n_reach, dtype=np.float64)
+        self.m2 = np.zeros(n_reach, dtype=np.float64)
+        self.maximum = np.full(n_reach, -np.inf, dtype=np.float64)
+        self.argmax = np.full(n_reach, -1, dtype=np.int64)
+        self.volume = np.zeros(n_reach, dtype=np.float64)
+        self.edges = np.geomspace(hist_min, hist_max, n_bins + 1)
+        self.hist = np.zeros((n_reach, n_bins + 2), dtype=np.uint32)
+        self.step = 0
+
+    def update(self, values, step_seconds):
+        """
+        :param values: np.ma.MaskedArray | np.ndarray(1-D), 单个时刻所有河段的流量（m3/s），缺测值为masked或nan
+        :param step_seconds: float, 该时刻代表的时间步长（秒），用于计算径流量
+        :return: None
+        """
+        values = np.ma.masked_invalid(np.ma.asarray(values, dtype=np.float64))
+        valid = ~np.ma.getmaskarray(values)
+        x = values.filled(0)
+        self.count += valid
+        delta = np.where(valid, x - self.mean, 0)
+        self.mean += delta / np.maximum(self.count, 1)
+        self.m2 += delta * (x - self.mean) * valid
+        is_max = valid & (x > self.maximum)
+        self.maximum[is_max] = x[is_max]
+        self.argmax[is_max] = self.step
+        self.volume += x * valid * step_seconds
+        bin_index = np.searchsorted(self.edges, x, side='right')
+        reach_index = np.flatnonzero(valid)
+        self.hist[reach_index, bin_index[reach_index]] += 1
+        self.step += 1
+
+    def quantile(self, q, block_size=65536):
+        """
+        :param q: float, 0~1
+        :param block_size: int, 每次计算的河段数
+        :return:
+            np.ndarray(1-D)，取累计计数达到q的区间的几何中心，位于第一个区间时为0，没有有效值时为nan
+        """
+        target = np.maximum(np.ceil(q * self.count), 1)
+        bin_index = np.empty(len(self.count), dtype=np.int64)
+        # 按河段分块计算累计计数（uint32，与直方图相同），临时数组大小与河段总数无关
+        for start in range(0, len(self.count), block_size):
+            stop = start + block_size
+            cumulative = np.cumsum(self.hist[start:stop], axis=1, dtype=np.uint32)
+            bin_index[start:stop] = np.argmax(cumulative >= target[start:stop, None], axis=1)
+        centers = np.concatenate([[0], np.sqrt(self.edges[:-1] * self.edges[1:]), [self.edges[-1]]])
+        result = centers[bin_index]
+        result[self.count == 0] = np.nan
+        return result
+
+    def std(self):
+        """
+        :return: np.ndarray(1-D)，样本标准差，有效值少于2个时为nan
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)
+
+def CHRTOUT_reach_statistics(CHRTOUT_dirpath:str, quantiles=(0.5, 0.95, 0.99), varname='streamflow', savepath=None):
+    """
+    每个CHRTOUT文件只读取一次，逐时刻更新所有河段的统计量，输出每个河段一行的统计表：
+    有效值个数、均值、标准差、最大值、最大值出现时间、总径流量（m3，流量×输出时间间隔累加）、各分位数（直方图近似）
+    :param CHRTOUT_dirpath:
+    :param quantiles: tuple[float], 0~1
+    :param varname: str, 变量名，默认为'streamflow'
+    :param savepath: str | PosixPath | None
+        为None时保存为"./Results/CHRTOUT reach statistics.csv"
+    :return:
+        dict, 列名 -> np.ndarray(1-D)，每个元素对应一个河段
+    """
+    file_paths, _ = get_filenames(CHRTOUT_dirpath, suffix='.CHRTOUT_DOMAIN1')
+    if len(file_paths) == 0:
+        raise FileNotFoundError(f"no .CHRTOUT_DOMAIN1 file in {CHRTOUT_dirpath}")
+    if savepath is None:
+        savepath = os.path.join(os.path.abspath(r"./Results"), 'CHRTOUT reach statistics.csv')
+    time_arr = np.array([get_CHRTOUT_time(filepath) for filepath in file_paths])
+    # 每个时刻代表到下一个输出时刻的时间段，最后一个时刻沿用前一个时间间隔（只有一个文件时为1小时）
+    step_seconds = np.array([(t1 - t0).total_seconds() for t0, t1 in zip(time_arr[:-1], time_arr[1:])])
+    step_seconds = np.append(step_seconds, step_seconds[-1] if len(step_seconds) > 0 else 3600)
+    feature_index = get_CHRTOUT_feature_index(file_paths[0])
+    stats = ReachStatistics(len(feature_index['feature_id']))
+    for filepath, seconds in tqdm.tqdm(zip(file_paths, step_seconds), total=len(file_paths), ncols=80,
+                                       desc="reach statistics progress"):
+        with DATASET_POOL.dataset(filepath) as dataset:
+            stats.update(dataset.variables[varname][:], seconds)
+
+    time_of_max = np.array([time_arr[i] if i >= 0 else '' for i in stats.argmax], dtype=object)
+    table = {'feature_id': feature_index['feature_id'],
+             'lon': feature_index['longitude'],
+             'lat': feature_index['latitude'],
+             'count': stats.count,
+             'mean': np.where(stats.count > 0, stats.mean, np.nan),
+             'std': stats.std(),
+             'max': np.where(stats.count > 0, stats.maximum, np.nan),
+             'time_of_max': time_of_max,
+             'volume': stats.volume}
+    for q in quantiles:
+        table[f'p{q * 100:g}'] = stats.quantile(q)
+    with open(savepath, 'w', newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(table.keys()))
+        writer.writerows(zip(*[column.tolist() for column in table.values()]))
+    print(f'save finished! {savepath}')
+    return table
+
 def main(type=2):
     if type == 1:
         plot_streamflow_map(filepath, output_type='show')
@@ -249,6 +994,14 @@ def main(type=2):
         read_CHRTOUT_streamflow_save_multi_fig(dirpath)
     elif type == 3:
         time_series_CHRTOUT_streamflow_to_csv(dirpath)
+    elif type == 4:
+        time_series_CHRTOUT_streamflow_to_netcdf(dirpath)
+    elif type == 5:
+        save_streamflow_animation(dirpath)
+    elif type == 6:
+        follow_CHRTOUT_run(dirpath)
+    elif type == 7:
+        CHRTOUT_reach_statistics(dirpath)
     else:
         raise ValueError("type is wrong.")
 
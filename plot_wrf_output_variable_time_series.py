@@ -2,7 +2,14 @@
 introduce:
     绘制WRF输出文件wrfout_d0*的各类型图和数据提取
     (1) 提取单一变量并保存为csv文件，默认提取变量名为'RAINNC'，默认保存路径为"./Results/wrfout_singlevar_output.csv"
-    (2) 提取降雨并绘制时序图
+    (2) 提取降雨并绘制时序图，默认逐个时刻读取并求和（streaming=True），内存占用只有一个格网的大小
+    (3) 提取降雨并计算shapefile中每个要素（如各州、各县）的面积加权均值时序，保存为csv文件，
+        默认保存路径为"./Results/wrfout regions time series.csv"
+    (4) 提取多个变量并逐个时刻保存为NetCDF4格网文件（float32，zlib压缩，每个时刻一个分块），
+        默认保存路径为"./Results/wrfout variables.nc"
+    (5) 目录中有多个模拟区域（如嵌套模拟的wrfout_d01_*、wrfout_d02_*）时，每个模拟区域在单独的进程中计算降雨时序，
+        并在同一张图中绘制；其它功能可通过wrfout_by_domain按模拟区域分别输出（文件名后添加"_d0*"）
+    wrfout文件按文件名中的模拟区域分组、按时间排序，目录中有多个模拟区域时(1)~(4)需要指定domain
 parameters:
     dirpath: str
         WRF的多个输出文件wrfout_d0*的存放目录
@@ -11,8 +18,13 @@ parameters:
     type: int
         1:  实现introduce中的功能（1）
         2： 实现introduce中的功能（2）,default
+        3： 实现introduce中的功能（3）
+        4： 实现introduce中的功能（4）
+        5： 实现introduce中的功能（5）
     varname: str
         type=1时需要提供的变量名，默认为"RAINNC"
+    USE_WRF_DISK_CACHE: bool
+        True时wrf.getvar的结果（wrf_diagnostic_cache.py）同时缓存在"./Results/wrf_cache"中，再次运行时直接读取
 
 usage:
     main(type=2)
@@ -26,46 +38,183 @@ import numpy as np
 from pathlib import Path
 from datetime import datetime
 import csv
+import re
+from concurrent.futures import ProcessPoolExecutor
 import wrf
-from GPM_draw import read_shapefile_boundaries, round_to_5_with_2_decimals, find_first_last_indices
+from region_mask import read_shapefile_features, get_region_mask
+from zonal_statistics import get_zonal_weights, zonal_mean, get_cell_cover_fraction
+from nc_handle_pool import DATASET_POOL
+from wrf_diagnostic_cache import WRF_CACHE, WRF_CACHE_DIR
 
 dirpath = r"./Data/wrfout_files/"
 varname = 'RAINNC'
 SHAPEFILEPATH = r'./USA_shp/jiazhou_merge.shp'
+USE_WRF_DISK_CACHE = False
 
 
-def wrfout_time_series_singlevar_savecsv(wrfout_dirpath, varname='RAINNC', savepath='./Results/wrfout_singlevar_output.csv'):
+WRFOUT_FILENAME_PATTERN = re.compile(r'^wrfout_d(\d{2})_(\d{4}-\d{2}-\d{2})_(\d{2})[:_](\d{2})[:_](\d{2})')
+
+
+def parse_wrfout_filename(filepath):
+    """
+    解析wrfout文件名（如wrfout_d02_2024-02-01_00:00:00，Windows下冒号可为下划线）中的模拟区域编号和时间
+    :param filepath: str | PosixPath
+    :return:
+        domain: int
+        time: datetime
+    """
+    match = WRFOUT_FILENAME_PATTERN.match(Path(filepath).name)
+    if match is None:
+        raise ValueError(f"not a wrfout file name: {Path(filepath).name}")
+    domain, date, HH, mm, ss = match.groups()
+    return int(domain), datetime.strptime(f'{date} {HH}:{mm}:{ss}', '%Y-%m-%d %H:%M:%S')
+
+
+def group_wrfout_files(dirpath):
+    """
+    将目录中的wrfout文件按模拟区域分组，每组按文件名中的时间排序，不是wrfout文件名的文件被忽略
+    :param dirpath: str
+    :return:
+        dict, domain -> (file_paths: list[PosixPath], file_times: list[datetime])
+    """
+    groups = {}
+    for file in Path(dirpath).iterdir():
+        if not file.is_file() or WRFOUT_FILENAME_PATTERN.match(file.name) is None:
+            continue
+        domain, time = parse_wrfout_filename(file)
+        groups.setdefault(domain, []).append((time, file.absolute()))
+    return {domain: ([file for _, file in sorted(files)], [time for time, _ in sorted(files)])
+            for domain, files in sorted(groups.items())}
+
+
+def get_wrfout_files(dirpath, domain=None):
+    """
+    获取目录中某一模拟区域按时间排序的wrfout文件
+    :param dirpath: str
+    :param domain: int | None
+        为None时目录中只能有一个模拟区域的文件，否则报错（避免把不同区域的文件当作同一时间序列）
+    :return:
+        file_paths: list[PosixPath]
+        file_times: list[datetime]
+    """
+    groups = group_wrfout_files(dirpath)
+    if len(groups) == 0:
+        raise FileNotFoundError(f"no wrfout file in {dirpath}")
+    if domain is None:
+        if len(groups) > 1:
+            raise ValueError(f"{dirpath} contains wrfout files of domains {list(groups)}, "
+                             f"specify domain or use wrfout_by_domain.")
+        domain = next(iter(groups))
+    if domain not in groups:
+        raise ValueError(f"no wrfout_d{domain:02d} file in {dirpath}, domains: {list(groups)}")
+    return groups[domain]
+
+
+def get_domain_savepath(savepath, domain):
+    """
+    在保存路径的文件名后添加模拟区域编号，如"./Results/wrfout variables.nc" -> "./Results/wrfout variables_d02.nc"
+    :param savepath: str | PosixPath
+    :param domain: int
+    :return: str
+    """
+    savepath = Path(savepath)
+    return str(savepath.with_name(f'{savepath.stem}_d{domain:02d}{savepath.suffix}'))
+
+
+def wrfout_by_domain(function, dirpath, savepath, workers=None, **kwargs):
+    """
+    对目录中的每个模拟区域分别调用function，每个模拟区域在单独的进程中处理，输出文件按模拟区域分开
+    （掩膜、权重按格网缓存，各区域也是分开的），嵌套模拟的总耗时约为最大区域的耗时
+    :param function: 第一个参数为dirpath、并有savepath和domain参数的函数，如wrfout_time_series_singlevar_savecsv、
+        wrfout_variables_to_netcdf、wrfout_regions_time_series_savecsv
+    :param dirpath: str
+        wrfout folder
+    :param savepath: str
+        保存路径，各模拟区域的输出文件名后添加"_d0*"
+    :param workers: int | None
+        进程数，为None时每个模拟区域一个进程
+    :param kwargs: function的其它参数
+    :return:
+        dict, domain -> 输出文件路径
+    """
+    domains = list(group_wrfout_files(dirpath))
+    savepaths = {domain: get_domain_savepath(savepath, domain) for domain in domains}
+    with ProcessPoolExecutor(max_workers=workers or max(1, len(domains))) as executor:
+        futures = [executor.submit(function, dirpath, savepath=savepaths[domain], domain=domain, **kwargs)
+                   for domain in domains]
+        for future in futures:
+            future.result()
+    return savepaths
+
+
+def _wrfout_region_precip_series(args):
+    """
+    计算单个模拟区域的研究区域降雨时序，供wrfout_precip_time_series_plot_domains的工作进程调用
+    :param args: tuple, (file_paths, shapefile_path, variables)
+    :return:
+        t: tuple[datetime]
+        data_time_series: tuple[float]
+    """
+    file_paths, shapefile_path, variables = args
+    return tuple(zip(*iter_wrfout_region_precip(file_paths, shapefile_path, variables)))
+
+
+def wrfout_precip_time_series_plot_domains(dirpath:str, shapefile_path:str, variables=['RAINC', 'RAINNC', 'RAINSH'],
+                                           workers=None):
+    """
+    读取目录中所有模拟区域（wrfout_d01_*, wrfout_d02_*, ...）的降雨量，每个模拟区域在单独的进程中计算研究区域均值时序，
+    在同一张图中绘制各区域的时序
+    :param dirpath: str
+        wrfout folder
+    :param shapefile_path: str
+        指定区域的shapefile文件路径
+    :param variables: list[str]
+        求和的变量名
+    :param workers: int | None
+        进程数，为None时每个模拟区域一个进程
+    :return:
+    """
+    groups = group_wrfout_files(dirpath)
+    tasks = [(file_paths, shapefile_path, variables) for file_paths, _ in groups.values()]
+    with ProcessPoolExecutor(max_workers=workers or max(1, len(tasks))) as executor:
+        results = list(executor.map(_wrfout_region_precip_series, tasks))
+    for domain, (t, data_time_series) in zip(groups, results):
+        plt.plot(t, np.array(data_time_series), label=f'd{domain:02d}')
+    plt.legend()
+    plt.show()
+
+
+def wrfout_time_series_singlevar_savecsv(wrfout_dirpath, varname='RAINNC', savepath='./Results/wrfout_singlevar_output.csv',
+                                         domain=None):
     """
     读取所有wrf-hydro输出CHRTOUT文件中的lon，lat、streamflow数据和对应的时间，并输出为csv文件
     :param CHRTOUT_dirpath:WRF的多个输出文件wrfout_d0*的存放目录
     :param savepath: csv文件保存路径
+    :param domain: int | None
+        模拟区域编号（如wrfout_d02_*为2），为None时目录中只能有一个模拟区域的文件
     :return: None
         输出csv文件格式
         每一行代表一个时间点的streamflow数据，文件第一行为经度，第二行为纬度，第一列为时间，中间为数据
     """
-    folder = Path(wrfout_dirpath)
-    file_paths = sorted([file.absolute() for file in folder.iterdir() if file.is_file()])
+    file_paths, file_times = get_wrfout_files(wrfout_dirpath, domain)
     n_file = len(file_paths)
     count = 0
-    wrfoutlist = []
+    var_list = []
 
     # 读取变量并保存为二维数组，一行代表一个时间点，并读取时间，保存为lons，lats，vars，t
-    for filename in file_paths:
-        dataset = nc.Dataset(filename)
-        wrfoutlist.append(dataset)
+    # 逐个文件读取（通过共用的句柄池和缓存），不同时打开所有wrfout文件
+    for filename, file_time in zip(file_paths, file_times):
+        var_list.append(WRF_CACHE.getvar(filename, varname, timeidx=wrf.ALL_TIMES, squeeze=False))
 
-        YYYY, MM, DD, HH, mm, ss = filename.stem[11:15], filename.stem[16:18], filename.stem[19:21], filename.stem[22:24], filename.stem[25:27], filename.stem[28:]
-        time_str = f'{YYYY}-{MM}-{DD} {HH}:{mm}:{ss}'
-        time = np.atleast_2d(datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S'))
+        time = np.atleast_2d(file_time)
         if count == 0:
             t = time
             count = count + 1
         else:
             t = np.vstack((t, time))
             count = count + 1
-    var_cat = wrf.to_np(wrf.getvar(wrfoutlist, varname, timeidx=wrf.ALL_TIMES, method='cat'))
-    XLONG = wrf.to_np(wrf.getvar(dataset, 'XLONG'))
-    XLAT = wrf.to_np(wrf.getvar(dataset, 'XLAT'))
+    var_cat = np.concatenate(var_list, axis=0)
+    XLONG, XLAT = WRF_CACHE.latlon(file_paths[0])
 
     # 将经度格网XLONG和纬度格网XLAT二维转换为一维列向量lon_arr\lat_arr,并将变量数组var_cat由三维转为二维var_cat_arr,每一行代表一个时间点的变量数据，与降维后的经纬度向量lon_arr\lat_arr中的元素一一对应,可用于后续利用经纬度和对应点变量数据绘图
     time_dim, lon_dim, lat_dim = var_cat.shape
@@ -81,28 +230,143 @@ def wrfout_time_series_singlevar_savecsv(wrfout_dirpath, varname='RAINNC', savep
         writer.writerows(output_data)
     print('finished!')
 
-def wrfout_precip_time_series_plot(dirpath:str, shapefile_path:str, variables=['RAINC', 'RAINNC', 'RAINSH']):
+def wrfout_variables_to_netcdf(wrfout_dirpath, variables=['RAINC', 'RAINNC', 'RAINSH'],
+                               savepath='./Results/wrfout variables.nc', domain=None):
+    """
+    读取所有wrfout文件中的多个变量（wrf.getvar支持的变量名，包括诊断变量），逐个时刻写入NetCDF4格网文件，
+    所有变量只需遍历一次wrfout文件
+    文件结构：
+        dimensions: time(unlimited), south_north, west_east（三维变量另有bottom_top等垂直维度）
+        time(time): int32, minutes since 1970-01-01 00:00:00
+        XLONG(south_north, west_east), XLAT(south_north, west_east): 只保存一次
+        各变量(time, ...): float32，zlib压缩，每个时刻为一个分块，读取单个时刻时只需解压一个分块
+    :param wrfout_dirpath: WRF的多个输出文件wrfout_d0*的存放目录
+    :param variables: list[str], 变量名
+    :param savepath: NetCDF4文件保存路径
+    :param domain: int | None
+        模拟区域编号（如wrfout_d02_*为2），为None时目录中只能有一个模拟区域的文件
+    :return: None
+    """
+    file_paths, file_times = get_wrfout_files(wrfout_dirpath, domain)
+    time_units = 'minutes since 1970-01-01 00:00:00'
+    count = 0
+    DATASET_POOL.close(savepath)
+    with nc.Dataset(savepath, 'w', format='NETCDF4') as store:
+        store.createDimension('time', None)
+        time_var = store.createVariable('time', 'i4', ('time',))
+        time_var.units = time_units
+        store_vars = {}
+        for filename in file_paths:
+            if count == 0:
+                XLONG, XLAT = WRF_CACHE.latlon(filename)
+                for dim, size in zip(('south_north', 'west_east'), np.shape(XLONG)):
+                    store.createDimension(dim, size)
+                for name, value in (('XLONG', XLONG), ('XLAT', XLAT)):
+                    var = store.createVariable(name, 'f4', ('south_north', 'west_east'), zlib=True)
+                    var.units = 'degree_east' if name == 'XLONG' else 'degree_north'
+                    var[:] = value
+            times = WRF_CACHE.times(filename).astype(datetime)
+            for timeidx, time in enumerate(times):
+                time_var[count] = nc.date2num(time, time_units)
+                for varname in variables:
+                    # 同一文件、同一时刻的多个诊断变量共用缓存的中间变量
+                    value, meta = WRF_CACHE.getvar(filename, varname, timeidx=timeidx, return_meta=True, keep=False)
+                    if varname not in store_vars:
+                        # 维度名来自wrf-python返回的DataArray或wrfout中原变量的维度名
+                        dims = meta['dims']
+                        for dim, size in zip(dims, np.shape(value)):
+                            if dim not in store.dimensions:
+                                store.createDimension(dim, size)
+                        store_vars[varname] = store.createVariable(
+                            varname, 'f4', ('time',) + tuple(dims), zlib=True, complevel=4, shuffle=True,
+                            chunksizes=(1,) + np.shape(value))
+                        if meta['units'] is not None:
+                            store_vars[varname].units = meta['units']
+                    store_vars[varname][count] = value
+                count += 1
+    print(f'save finished! {savepath}')
+
+def get_wrf_region_mask(XLONG, XLAT, shapefile_path, mode='center', min_fraction=0.5):
+    """
+    制作shapefile研究区域在WRF曲线格网（XLONG/XLAT）上的掩膜，按shapefile和格网的哈希值缓存在磁盘上，
+    同一模拟区域再次运行时直接读取
+    :param XLONG: np.ndarray(2-D)
+    :param XLAT: np.ndarray(2-D)
+    :param shapefile_path: str
+    :param mode: str
+        'center'：格网中心位于研究区域内（region_mask.get_region_mask）
+        'cell'：格网单元位于研究区域内的面积比例不小于min_fraction（zonal_statistics.get_cell_cover_fraction）
+    :param min_fraction: float, mode='cell'时使用
+    :return:
+        area_mask2: np.ndarray(2-D, bool)
+    """
+    if mode == 'center':
+        return get_region_mask(shapefile_path, XLONG, XLAT)
+    elif mode == 'cell':
+        return get_cell_cover_fraction(shapefile_path, XLONG, XLAT) >= min_fraction
+    raise ValueError("mode must be 'center' or 'cell'.")
+
+
+def iter_wrfout_region_precip(file_paths, shapefile_path, variables=['RAINC', 'RAINNC', 'RAINSH']):
+    """
+    逐个文件、逐个时刻读取wrfout中的降雨分量，在同一个二维数组中求和后计算研究区域均值，
+    每个时刻返回一个值，内存占用只有一个格网的大小，与文件数量无关
+    :param file_paths: list[PosixPath]
+        按时间排序的wrfout文件路径
+    :param shapefile_path: str
+        指定区域的shapefile文件路径
+    :param variables: list[str]
+        求和的变量名
+    :return:
+        generator, (time: datetime, value: float)
+    """
+    var_sum, area_mask, len_mask_point = None, None, 0
+    for filename in file_paths:
+        if var_sum is None:
+            XLONG, XLAT = WRF_CACHE.latlon(filename)
+            area_mask = get_wrf_region_mask(XLONG, XLAT, shapefile_path)
+            len_mask_point = np.sum(area_mask)
+            var_sum = np.zeros(XLONG.shape, dtype=np.float64)
+        times = WRF_CACHE.times(filename).astype(datetime)
+        for timeidx, time in enumerate(times):
+            var_sum.fill(0)
+            for varname in variables:
+                # 逐个时刻的降雨分量只使用一次，不保存到缓存中
+                var_sum += WRF_CACHE.getvar(filename, varname, timeidx=timeidx, keep=False)
+            yield time, np.nansum(var_sum[area_mask]) / len_mask_point
+
+
+def wrfout_precip_time_series_plot(dirpath:str, shapefile_path:str, variables=['RAINC', 'RAINNC', 'RAINSH'],
+                                   streaming=True, domain=None):
     """
     读取wrfout中的降雨量和指定区域的shapefile文件绘制时序图
     :param dirpath: str
         wrfout folder
     :parm shapefile_path: str
         指定区域的shapefile文件路径
+    :param streaming: bool
+        True：逐个时刻读取并求和（iter_wrfout_region_precip），内存占用只有一个格网的大小
+        False：读取所有文件的所有变量后再求和
+    :param domain: int | None
+        模拟区域编号（如wrfout_d02_*为2），为None时目录中只能有一个模拟区域的文件
     :return:
     """
     # 读取所有文件路径
-    folder = Path(dirpath)
-    file_paths = sorted([file.absolute() for file in folder.iterdir() if file.is_file()])
+    file_paths, file_times = get_wrfout_files(dirpath, domain)
     n_file = len(file_paths)
+    if streaming:
+        t, data_time_series = zip(*iter_wrfout_region_precip(file_paths, shapefile_path, variables))
+        plt.plot(t, np.array(data_time_series))
+        plt.show()
+        return
     # 读取经纬度,时间和变量并合并变量,保存为XLONG, XLAT, t, var_sum
     count, count_var = 0, 0
-    wrfoutlist = []
-    for filename in file_paths:
-        dataset = nc.Dataset(filename)
-        wrfoutlist.append(dataset)
-        YYYY, MM, DD, HH, mm, ss = filename.stem[11:15], filename.stem[16:18], filename.stem[19:21], filename.stem[22:24], filename.stem[25:27], filename.stem[28:]
-        time_str = f'{YYYY}-{MM}-{DD} {HH}:{mm}:{ss}'
-        time = np.atleast_2d(datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S'))
+    var_lists = {varname: [] for varname in variables}
+    for filename, file_time in zip(file_paths, file_times):
+        # 逐个文件读取（通过共用的句柄池和缓存），不同时打开所有wrfout文件
+        for varname in variables:
+            var_lists[varname].append(WRF_CACHE.getvar(filename, varname, timeidx=wrf.ALL_TIMES, squeeze=False))
+        time = np.atleast_2d(file_time)
         if count == 0:
             t = time
             count += 1
@@ -110,15 +374,14 @@ def wrfout_precip_time_series_plot(dirpath:str, shapefile_path:str, variables=['
             t = np.vstack((t, time))
             count += 1
 
-    XLONG = wrf.to_np(wrf.getvar(dataset, 'XLONG'))
-    XLAT = wrf.to_np(wrf.getvar(dataset, 'XLAT'))
+    XLONG, XLAT = WRF_CACHE.latlon(file_paths[0])
 
 
     # 提取变量并合并为var_data_sum: 3-d ndarray
     ex_vars = {}
     count = 0
     for varname in variables:
-        var_cat = wrf.to_np(wrf.getvar(wrfoutlist, varname, timeidx=wrf.ALL_TIMES, method='cat'))
+        var_cat = np.concatenate(var_lists[varname], axis=0)
         ''' 使用wrf.getvar()函数读取wrfout中的变量数据分布与panoply默认打开一致（西经：东经；南纬：北纬） '''
         """
         var_cat格网格式
@@ -148,28 +411,7 @@ def wrfout_precip_time_series_plot(dirpath:str, shapefile_path:str, variables=['
     var_data_sum = np.sum(all_var_cat, axis=0)
 
     ## 提取shapefile文件内的数据, 制作shapefile_path对应的掩膜文件area_mask2，ndarray
-    outline, polygon = read_shapefile_boundaries(shapefile_path)
-    round_XLONG = round_to_5_with_2_decimals(XLONG)
-    round_XLAT = round_to_5_with_2_decimals(XLAT)
-    outline_dec2 = round_to_5_with_2_decimals(outline)
-    unique_outline_dec2 = np.unique(outline_dec2, axis=0)
-    unique_lon, unique_lat = unique_outline_dec2[:, 0], unique_outline_dec2[:, 1]
-
-    min_rlat, max_rlat = round_XLAT.min(), round_XLAT.max()
-    min_rlon, max_rlon = round_XLONG.min(), round_XLONG.max()
-    area_mask = np.zeros_like(var_data_sum[0])
-
-    pcol_index = (10 * (- min_rlon + unique_lon)).astype(int)
-    prow_index = (10 * (- min_rlat + unique_lat)).astype(int)
-    area_mask[prow_index, pcol_index] = 1
-    area_mask2 = np.zeros_like(area_mask)
-
-    for row in range(area_mask.shape[0]):
-        row_mask = area_mask[row, :]
-        first_index, last_index = find_first_last_indices(row_mask, number=1)
-        if first_index != 0:
-            row_mask[first_index:last_index] = 1
-            area_mask2[row, :] = row_mask
+    area_mask2 = get_wrf_region_mask(XLONG, XLAT, shapefile_path).astype(var_data_sum.dtype)
 
     # 计算研究区域均值，生成时序data_time_series_arr
     data_time_series = []
@@ -187,12 +429,66 @@ def wrfout_precip_time_series_plot(dirpath:str, shapefile_path:str, variables=['
     plt.show()
 
 
+def wrfout_regions_time_series_savecsv(dirpath:str, shapefile_path:str, variables=['RAINC', 'RAINNC', 'RAINSH'],
+                                       name_field=None, savepath='./Results/wrfout regions time series.csv', domain=None):
+    """
+    读取wrfout中的降雨量，计算shapefile中每个要素（如gadm36_USA_2中的各县）的面积加权均值时序并保存为csv文件，
+    所有要素只需遍历一次wrfout文件，每次只打开一个文件
+    :param dirpath: str
+        wrfout folder
+    :param shapefile_path: str
+        多要素shapefile文件路径
+    :param variables: list[str]
+        求和的变量名
+    :param name_field: str | None
+        作为区域名称的属性字段，如'NAME_1'、'GID_2'，为None时使用要素序号
+    :param savepath: str
+        csv文件保存路径
+        文件格式：第一行为区域名称，第一列为时间，中间为数据（time × region）
+    :param domain: int | None
+        模拟区域编号（如wrfout_d02_*为2），为None时目录中只能有一个模拟区域的文件
+    :return:
+        time_arr: np.ndarray(1-D)
+        regions_time_series_arr: np.ndarray(2-D), (time, region)
+        names: list[str]
+    """
+    file_paths, file_times = get_wrfout_files(dirpath, domain)
+    _, names = read_shapefile_features(shapefile_path, name_field)
+    weights = None
+    time_list, rows = [], []
+    with open(savepath, 'w', newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(['time'] + names)
+        for filename in file_paths:
+            if weights is None:
+                XLONG, XLAT = WRF_CACHE.latlon(filename)
+                weights = get_zonal_weights(shapefile_path, XLONG, XLAT, by_feature=True)
+            times = WRF_CACHE.times(filename).astype(datetime)
+            var_sum = sum(WRF_CACHE.getvar(filename, varname, timeidx=wrf.ALL_TIMES, squeeze=False)
+                          for varname in variables)
+            file_mean = zonal_mean(var_sum, weights)
+            for time, row in zip(times, file_mean):
+                writer.writerow([time] + row.tolist())
+                time_list.append(time)
+                rows.append(row)
+    print(f'save finished! {savepath}')
+    return np.array(time_list), np.array(rows), names
+
+
 def main(type=2):
+    if USE_WRF_DISK_CACHE:
+        WRF_CACHE.cache_dir = WRF_CACHE_DIR
 
     if type == 1:
         wrfout_time_series_singlevar_savecsv(dirpath)
     elif type == 2:
         wrfout_precip_time_series_plot(dirpath, SHAPEFILEPATH)
+    elif type == 3:
+        wrfout_regions_time_series_savecsv(dirpath, SHAPEFILEPATH)
+    elif type == 4:
+        wrfout_variables_to_netcdf(dirpath)
+    elif type == 5:
+        wrfout_precip_time_series_plot_domains(dirpath, SHAPEFILEPATH)
     else:
         raise ValueError("type is wrong.")
 
@@ -0,0 +1,156 @@
+"""
+introduce:
+    根据shapefile文件制作研究区域在格网上的掩膜，供GPM_draw.py、plot_wrf_output_variable_time_series.py使用
+    (1) 使用向量化的点在多边形内判断（shapely.contains_xy）一次性计算所有格网中心是否位于研究区域内
+    (2) 掩膜保存在磁盘上，文件名由shapefile文件内容的哈希值和格网经纬度的哈希值组成，
+        同一shapefile和格网再次运行时直接读取，不再重新计算
+parameters:
+    MASK_CACHE_DIR: str
+        掩膜缓存目录，默认为"./Results/mask_cache"
+usage:
+    region_mask = get_region_mask(SHAPEFILEPATH, lon, lat)
+"""
+
+import hashlib
+from pathlib import Path
+import numpy as np
+import shapefile
+import shapely
+from shapely.geometry import shape, Polygon
+from shapely.ops import unary_union
+
+MASK_CACHE_DIR = r'./Results/mask_cache'
+SHAPEFILE_SUFFIXES = ['.shp', '.shx', '.dbf', '.prj']
+
+
+def get_shapefile_hash(shapefile_path):
+    """
+    计算shapefile文件（.shp, .shx, .dbf, .prj）内容的哈希值
+    :param shapefile_path: str | PosixPath
+    :return:
+        str
+    """
+    sha1 = hashlib.sha1()
+    for suffix in SHAPEFILE_SUFFIXES:
+        path = Path(shapefile_path).with_suffix(suffix)
+        if path.exists():
+            sha1.update(path.read_bytes())
+    return sha1.hexdigest()
+
+
+def get_grid_hash(*arrays):
+    """
+    计算格网定义（经纬度数组的形状、类型和数值）的哈希值
+    :param arrays: np.ndarray
+    :return:
+        str
+    """
+    sha1 = hashlib.sha1()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        sha1.update(str(arr.shape).encode())
+        sha1.update(str(arr.dtype).encode())
+        sha1.update(arr.tobytes())
+    return sha1.hexdigest()
+
+
+def shape_to_polygon(shp):
+    """
+    将shapefile中的单个要素转换为多边形
+    面要素直接转换（保留多部分和内环）；线要素（如研究区域边界线）与read_shapefile_boundaries一致，
+    将所有边界点连成多边形，并修复自相交
+    :param shp: shapefile.Shape
+    :return:
+        Polygon | MultiPolygon
+    """
+    if shp.shapeType in (shapefile.POLYGON, shapefile.POLYGONZ, shapefile.POLYGONM):
+        geom = shape(shp.__geo_interface__)
+    else:
+        geom = shapely.make_valid(Polygon(shp.points))
+    polygons = [part for part in shapely.get_parts(geom) if part.geom_type == 'Polygon']
+    return unary_union(polygons)
+
+
+def read_shapefile_polygon(shapefile_path):
+    """
+    读取shapefile文件中的所有要素并合并为一个多边形
+    :param shapefile_path: str | PosixPath
+    :return:
+        Polygon | MultiPolygon
+    """
+    sf = shapefile.Reader(str(shapefile_path))
+    return unary_union([shape_to_polygon(shp) for shp in sf.shapes()])
+
+
+def read_shapefile_features(shapefile_path, name_field=None):
+    """
+    读取shapefile文件中的每个要素（不合并），用于多区域（如各州、各县）分别统计
+    :param shapefile_path: str | PosixPath
+    :param name_field: str | None
+        作为区域名称的属性字段，如'NAME_1'、'GID_2'，为None时使用要素序号
+    :return:
+        polygons: list[Polygon | MultiPolygon]
+        names: list[str]
+    """
+    sf = shapefile.Reader(str(shapefile_path))
+    polygons = [shape_to_polygon(shp) for shp in sf.shapes()]
+    if name_field is None:
+        names = [str(i) for i in range(len(polygons))]
+    else:
+        names = [str(record[name_field]) for record in sf.records()]
+    return polygons, names
+
+
+def get_grid_lonlat(lon, lat):
+    """
+    将格网经纬度统一为二维数组
+    :param lon: np.ndarray, 1-D（规则格网）或 2-D（如WRF的XLONG）
+    :param lat: np.ndarray, 1-D（规则格网）或 2-D（如WRF的XLAT）
+    :return:
+        lon2d, lat2d: np.ndarray(2-D)，1-D输入时形状为(len(lat), len(lon))
+    """
+    lon, lat = np.asarray(lon), np.asarray(lat)
+    if lon.ndim == 1 and lat.ndim == 1:
+        return np.meshgrid(lon, lat)
+    return lon, lat
+
+
+def build_grid_mask(lon, lat, polygon):
+    """
+    计算格网中心是否位于多边形内，只对多边形外包矩形内的格网中心做判断
+    :param lon: np.ndarray, 1-D 或 2-D
+    :param lat: np.ndarray, 1-D 或 2-D
+    :param polygon: Polygon | MultiPolygon
+    :return:
+        mask: np.ndarray(2-D, bool)，1-D输入时形状为(len(lat), len(lon))
+    """
+    lon2d, lat2d = get_grid_lonlat(lon, lat)
+    min_lon, min_lat, max_lon, max_lat = polygon.bounds
+    mask = np.zeros(lon2d.shape, dtype=bool)
+    in_bounds = (lon2d >= min_lon) & (lon2d <= max_lon) & (lat2d >= min_lat) & (lat2d <= max_lat)
+    shapely.prepare(polygon)
+    mask[in_bounds] = shapely.contains_xy(polygon, lon2d[in_bounds], lat2d[in_bounds])
+    return mask
+
+
+def get_region_mask(shapefile_path, lon, lat, cache_dir=MASK_CACHE_DIR):
+    """
+    获取shapefile研究区域在格网上的掩膜，优先读取磁盘缓存
+    :param shapefile_path: str | PosixPath
+    :param lon: np.ndarray, 1-D 或 2-D
+    :param lat: np.ndarray, 1-D 或 2-D
+    :param cache_dir: str | None
+        掩膜缓存目录，为None时不使用缓存
+    :return:
+        mask: np.ndarray(2-D, bool)，1-D输入时形状为(len(lat), len(lon))
+    """
+    if cache_dir is None:
+        return build_grid_mask(lon, lat, read_shapefile_polygon(shapefile_path))
+    cache_path = Path(cache_dir).joinpath(
+        f'{get_shapefile_hash(shapefile_path)[:16]}_{get_grid_hash(lon, lat)[:16]}.npy')
+    if cache_path.exists():
+        return np.load(cache_path)
+    mask = build_grid_mask(lon, lat, read_shapefile_polygon(shapefile_path))
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    np.save(cache_path, mask)
+    return mask
@@ -0,0 +1,112 @@
+"""
+follow_CHRTOUT_run（跟踪模式）的测试：轮询期间逐个写入CHRTOUT文件，检查csv行数和检查点
+运行：python -m pytest -q tests
+"""
+
+import json
+import shutil
+import sys
+from pathlib import Path
+import pytest
+
+pytest.importorskip('netCDF4')
+pytest.importorskip('mpl_toolkits.basemap')
+import matplotlib
+matplotlib.use('Agg')
+
+REPO_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(REPO_DIR))
+import plot_CHRTOUT_streamflow_map as C
+
+CHRTOUT_FILES = sorted(REPO_DIR.joinpath('Data', 'CHRTOUT_files').glob('*.CHRTOUT_DOMAIN1'))
+CSV_NAME = 'CHRTOUT streamflow output time series.csv'
+CHECKPOINT_NAME = 'CHRTOUT follow checkpoint.json'
+
+
+@pytest.fixture
+def run_dir(tmp_path, monkeypatch):
+    if len(CHRTOUT_FILES) < 3:
+        pytest.skip('needs Data/CHRTOUT_files')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(C, 'SHAPEFILEPATH', str(REPO_DIR.joinpath('Data', 'USA_shp', 'jiazhou_merge.shp')))
+    tmp_path.joinpath('Results').mkdir()
+    run = tmp_path.joinpath('run')
+    run.mkdir()
+    return run
+
+
+def drop_files_on_sleep(monkeypatch, run, files):
+    # 每次轮询间隔时向运行目录写入一个新文件，模拟WRF-Hydro运行中的输出
+    pending = list(files)
+
+    def sleep(seconds):
+        if pending:
+            shutil.copy(pending.pop(0), run)
+    monkeypatch.setattr(C.time, 'sleep', sleep)
+
+
+def read_csv_times(path):
+    with open(path) as f:
+        return [line.split(',', 1)[0] for line in f]
+
+
+def test_follow_appends_only_new_files(run_dir, monkeypatch):
+    files = CHRTOUT_FILES[:3]
+    shutil.copy(files[0], run_dir)
+    drop_files_on_sleep(monkeypatch, run_dir, files[1:])
+    # 文件需要在两次轮询之间大小不变才会被处理，最后一个文件在第3次轮询前写入、第4次轮询时处理
+    C.follow_CHRTOUT_run(str(run_dir), interval=0, max_polls=4)
+
+    results = Path('Results')
+    times = read_csv_times(results.joinpath(CSV_NAME))
+    assert times == ['lon', 'lat'] + [str(C.get_CHRTOUT_time(path)) for path in files]
+    with open(results.joinpath(CHECKPOINT_NAME)) as f:
+        assert json.load(f)['processed'] == [path.name.split('.')[0] for path in files]
+    assert len(list(results.joinpath('CHRTOUT_output_figs').glob('*.png'))) == len(files)
+    assert results.joinpath('CHRTOUT_output_figs', 'concat_image.jpg').exists()
+
+    # 重新批量绘图（清空专题地图目录）后继续跟踪，已处理的文件不会重复写入csv
+    C.read_CHRTOUT_streamflow_save_multi_fig(str(run_dir))
+    C.follow_CHRTOUT_run(str(run_dir), interval=0, max_polls=2)
+    assert read_csv_times(results.joinpath(CSV_NAME)) == times
+
+
+def test_follow_recovers_interrupted_checkpoint(run_dir, monkeypatch):
+    # 模拟csv写入最后一行后、检查点保存前被中断（Ctrl+C）：检查点中缺少最后一个文件
+    files = CHRTOUT_FILES[:3]
+    for path in files:
+        shutil.copy(path, run_dir)
+    C.follow_CHRTOUT_run(str(run_dir), interval=0, max_polls=2)
+    results = Path('Results')
+    times = read_csv_times(results.joinpath(CSV_NAME))
+    checkpoint = results.joinpath(CHECKPOINT_NAME)
+    with open(checkpoint) as f:
+        processed = json.load(f)['processed']
+    with open(checkpoint, 'w') as f:
+        json.dump({'processed': processed[:-1]}, f)
+
+    C.follow_CHRTOUT_run(str(run_dir), interval=0, max_polls=2)
+    assert read_csv_times(results.joinpath(CSV_NAME)) == times
+    with open(checkpoint) as f:
+        assert json.load(f)['processed'] == processed
+
+    # 最后一行未写完时删除该行并重新处理对应的文件
+    with open(results.joinpath(CSV_NAME), 'rb+') as f:
+        content = f.read()
+        f.truncate(content.rstrip(b'\r\n').rfind(b'\n') + 20)
+    with open(checkpoint, 'w') as f:
+        json.dump({'processed': processed[:-1]}, f)
+    C.follow_CHRTOUT_run(str(run_dir), interval=0, max_polls=2)
+    assert read_csv_times(results.joinpath(CSV_NAME)) == times
+
+
+def test_follow_refuses_csv_with_unprocessed_times(run_dir, monkeypatch, tmp_path):
+    shutil.copy(CHRTOUT_FILES[0], run_dir)
+    C.follow_CHRTOUT_run(str(run_dir), interval=0, max_polls=2)
+    Path('Results', CHECKPOINT_NAME).unlink()
+    # csv中的时间在另一个运行目录中没有对应的文件，也不在检查点中
+    other_run = tmp_path.joinpath('other_run')
+    other_run.mkdir()
+    shutil.copy(CHRTOUT_FILES[1], other_run)
+    with pytest.raises(ValueError):
+        C.follow_CHRTOUT_run(str(other_run), interval=0, max_polls=2)
@@ -0,0 +1,232 @@
+"""
+introduce:
+    wrf.getvar的缓存层，供plot_wrf_output_variable_time_series.py使用
+    (1) 以(文件集合, 变量名, timeidx, method, squeeze)为键缓存wrf.getvar的结果，文件集合由各文件的路径、大小和修改时间确定，
+        文件被改写后自动失效；同一进程内的绘图、导出等重复读取同一变量时不再重新读取、计算
+    (2) 计算诊断变量（如'slp'、'rh2'、'ua'）时，先用wrf.extract_vars一次读取常用的中间变量（P、PB、PH、PHB、T、QVAPOR等），
+        作为wrf.getvar的cache参数，多个诊断变量共用这些中间变量
+    (3) 坐标（XLONG、XLAT）和时间只读取一次
+    (4) 内存中的缓存按LRU策略限制总大小；设置cache_dir时结果同时保存在磁盘上，再次运行时直接读取
+parameters:
+    WRF_CACHE: WRFDiagnosticCache
+        共用的缓存，默认只缓存在内存中（最多512MB）
+usage:
+    from wrf_diagnostic_cache import WRF_CACHE
+    XLONG, XLAT = WRF_CACHE.latlon(filepath)
+    slp = WRF_CACHE.getvar(filepath, 'slp', timeidx=0)
+    times = WRF_CACHE.times(filepath)
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack
+from pathlib import Path
+import numpy as np
+import wrf
+from nc_handle_pool import DATASET_POOL
+
+WRF_CACHE_DIR = r'./Results/wrf_cache'
+# 常用诊断变量共用的中间变量，只提取文件中存在的变量
+SHARED_CACHE_VARS = ('P', 'PB', 'PH', 'PHB', 'T', 'QVAPOR', 'HGT', 'PSFC', 'U', 'V', 'W', 'XLONG', 'XLAT')
+
+
+class WRFDiagnosticCache:
+    """
+    wrf.getvar、wrf.extract_times的结果缓存，返回值均为np.ndarray
+    """
+    def __init__(self, cache_dir=None, max_bytes=512 * 1024 ** 2, max_shared=4):
+        """
+        :param cache_dir: str | PosixPath | None
+            磁盘缓存目录，为None时只缓存在内存中
+        :param max_bytes: int, 内存缓存的最大字节数
+        :param max_shared: int, 内存中保留的中间变量组数（每组为一个文件集合、一个timeidx的中间变量）
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_shared = max_shared
+        self._shared = OrderedDict()            # (fileset_key, timeidx, method, squeeze) -> wrf.extract_vars的结果
+        self._entries = OrderedDict()           # key -> (value, meta)
+        self._nbytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    @staticmethod
+    def get_fileset_key(filepaths):
+        """
+        文件集合的哈希值，由各文件的绝对路径、大小和修改时间计算
+        :param filepaths: str | PosixPath | list
+        :return: str
+        """
+        if isinstance(filepaths, (str, os.PathLike)):
+            filepaths = [filepaths]
+        sha1 = hashlib.sha1()
+        for filepath in filepaths:
+            stat = os.stat(filepath)
+            sha1.update(f'{os.path.abspath(filepath)}|{stat.st_size}|{stat.st_mtime_ns};'.encode())
+        return sha1.hexdigest()
+
+    def _lookup(self, key):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        if self.cache_dir is not None:
+            cache_path = self._cache_path(key)
+            if cache_path.exists():
+                with np.load(cache_path, allow_pickle=False) as cache:
+                    entry = (cache['value'], json.loads(str(cache['meta'])))
+                with self._lock:
+                    self.disk_hits += 1
+                    self._store(key, entry)
+                return entry
+        return None
+
+    def _store(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                self._nbytes -= self._entries.pop(key)[0].nbytes
+            self._entries[key] = entry
+            self._nbytes += entry[0].nbytes
+            while self._nbytes > self.max_bytes and len(self._entries) > 1:
+                _, (value, _) = self._entries.popitem(last=False)
+                self._nbytes -= value.nbytes
+
+    def _cache_path(self, key):
+        return Path(self.cache_dir).joinpath(hashlib.sha1(repr(key).encode()).hexdigest()[:24] + '.npz')
+
+    def _save(self, key, entry):
+        self._store(key, entry)
+        if self.cache_dir is not None:
+            cache_path = self._cache_path(key)
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_name(cache_path.stem + '.tmp.npz')
+            np.savez(tmp_path, value=entry[0], meta=json.dumps(entry[1]))
+            os.replace(tmp_path, cache_path)
+
+    def _compute(self, filepaths, function):
+        # 通过共用的句柄池打开（并固定）文件集合中的所有文件
+        paths = [filepaths] if isinstance(filepaths, (str, os.PathLike)) else list(filepaths)
+        with ExitStack() as stack:
+            datasets = [stack.enter_context(DATASET_POOL.dataset(path)) for path in paths]
+            return function(datasets[0] if len(datasets) == 1 else datasets)
+
+    def _shared_vars(self, filepaths, fileset_key, timeidx, method, squeeze):
+        """
+        诊断变量共用的中间变量（wrf.getvar的cache参数），每个文件集合、timeidx和squeeze只提取一次，
+        只在内存中保留最近使用的max_shared组
+        wrf-python直接使用cache中的数组（诊断变量的维度也由其确定），因此中间变量的squeeze必须与getvar一致
+        """
+        key = (fileset_key, timeidx, method, squeeze)
+        with self._lock:
+            if key in self._shared:
+                self._shared.move_to_end(key)
+                return self._shared[key]
+
+        def extract(wrfin):
+            first = wrfin[0] if isinstance(wrfin, list) else wrfin
+            varnames = [varname for varname in SHARED_CACHE_VARS if varname in first.variables]
+            return wrf.extract_vars(wrfin, timeidx, varnames, method=method, squeeze=squeeze)
+        shared = self._compute(filepaths, extract)
+        with self._lock:
+            self._shared[key] = shared
+            while len(self._shared) > self.max_shared:
+                self._shared.popitem(last=False)
+        return shared
+
+    def getvar(self, filepaths, varname, timeidx=0, method='cat', squeeze=True, return_meta=False, keep=True):
+        """
+        带缓存的wrf.getvar
+        :param filepaths: str | PosixPath | list, 单个wrfout文件或文件集合（按时间排序）
+        :param varname: str, wrfout中的变量名或wrf-python的诊断变量名
+        :param timeidx: int | None, wrf.ALL_TIMES(None)时读取所有时刻
+        :param method: str, 'cat' | 'join'
+        :param squeeze: bool
+        :param return_meta: bool
+            True时同时返回维度名和单位（wrf-python返回DataArray时可用，否则为wrfout中原变量的维度名和单位）
+        :param keep: bool
+            False时计算结果不保存到缓存中（已缓存时仍直接读取），用于逐个时刻流式读取、只使用一次的变量
+        :return:
+            value: np.ndarray
+            meta: dict, 'dims', 'units'（return_meta=True时）
+        """
+        fileset_key = self.get_fileset_key(filepaths)
+        key = (fileset_key, varname, timeidx, method, squeeze)
+        entry = self._lookup(key)
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+
+            def compute(wrfin):
+                first = wrfin[0] if isinstance(wrfin, list) else wrfin
+                if varname in first.variables:
+                    value = wrf.getvar(wrfin, varname, timeidx=timeidx, method=method, squeeze=squeeze)
+                else:
+                    cache = self._shared_vars(filepaths, fileset_key, timeidx, method, squeeze)
+                    value = wrf.getvar(wrfin, varname, timeidx=timeidx, method=method, squeeze=squeeze, cache=cache)
+                dims = getattr(value, 'dims', None)
+                units = getattr(value, 'attrs', {}).get('units')
+                if dims is None and varname in first.variables:
+                    dims = first.variables[varname].dimensions
+                    if squeeze and np.ndim(value) < len(dims):
+                        dims = [dim for dim in dims if dim != 'Time']
+                if units is None and varname in first.variables:
+                    units = getattr(first.variables[varname], 'units', None)
+                return np.asarray(wrf.to_np(value)), {'dims': list(dims) if dims is not None else None,
+                                                      'units': units}
+            entry = self._compute(filepaths, compute)
+            if keep:
+                self._save(key, entry)
+        return entry if return_meta else entry[0]
+
+    def latlon(self, filepaths):
+        """
+        :param filepaths: str | PosixPath | list
+        :return:
+            XLONG, XLAT: np.ndarray(2-D)，第一个时刻的经纬度格网
+        """
+        return self.getvar(filepaths, 'XLONG'), self.getvar(filepaths, 'XLAT')
+
+    def times(self, filepaths):
+        """
+        带缓存的wrf.extract_times（所有时刻）
+        :param filepaths: str | PosixPath | list
+        :return:
+            np.ndarray(1-D, datetime64[s])
+        """
+        key = (self.get_fileset_key(filepaths), '__times__', None, 'cat', True)
+        entry = self._lookup(key)
+        if entry is None:
+            with self._lock:
+                self.misses += 1
+            times = self._compute(filepaths, lambda wrfin: wrf.extract_times(wrfin, wrf.ALL_TIMES))
+            entry = (np.atleast_1d(np.asarray(times)).astype('datetime64[s]'), {})
+            self._save(key, entry)
+        return entry[0]
+
+    def clear(self):
+        """
+        清空内存中的缓存（不删除磁盘缓存）
+        :return: None
+        """
+        with self._lock:
+            self._entries.clear()
+            self._shared.clear()
+            self._nbytes = 0
+
+    def metrics(self):
+        """
+        :return:
+            dict, 'entries', 'nbytes', 'max_bytes', 'hits', 'disk_hits', 'misses'
+        """
+        with self._lock:
+            return {'entries': len(self._entries), 'nbytes': self._nbytes, 'max_bytes': self.max_bytes,
+                    'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses}
+
+
+WRF_CACHE = WRFDiagnosticCache()
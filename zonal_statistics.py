@@ -0,0 +1,203 @@
+"""
+introduce:
+    格网数据（GPM降雨、WRF输出变量）的分区统计（面积加权区域均值）
+    (1) 根据多边形与格网单元的相交面积和格网单元所在纬度的cos值（格网面积随纬度变化），
+        预先计算稀疏权重矩阵 weights: (区域数, 格网数)，格网部分位于区域内时按相交面积比例计权
+    (2) 整个(time, 格网)数据立方体通过一次稀疏矩阵乘法得到所有区域的面积加权均值时序
+    (3) 同时支持规则经纬度格网（GPM的lon/lat，1-D）和曲线格网（WRF的XLONG/XLAT，2-D）
+    (4) 权重矩阵按shapefile和格网的哈希值缓存在磁盘上（与region_mask.py共用缓存目录）
+    (5) by_feature=True时shapefile中的每个要素（如各州、各县）为一个区域，一次计算得到所有区域的时序
+    (6) 由权重矩阵得到每个格网单元位于研究区域内的面积比例，可用于按格网单元（而非格网中心）制作掩膜
+parameters:
+    格网单元顺序与数据单个时刻的格网展开顺序一致：
+        lon/lat为1-D时，数据格网格式为(lon, lat)，与GPM文件中的precipitationCal一致
+        XLONG/XLAT为2-D时，数据格网格式与XLONG/XLAT相同，如WRF的(south_north, west_east)
+usage:
+    weights = get_zonal_weights(SHAPEFILEPATH, lon, lat)
+    time_series = zonal_mean(precip, weights)[:, 0]
+"""
+
+from pathlib import Path
+import numpy as np
+import shapely
+from scipy import sparse
+from region_mask import MASK_CACHE_DIR, get_shapefile_hash, get_grid_hash, read_shapefile_polygon, \
+    read_shapefile_features
+
+
+def get_curvilinear_cell_corners(XLONG, XLAT):
+    """
+    根据曲线格网的格网中心计算格网角点，内部角点为相邻四个格网中心的均值，边缘角点线性外推
+    :param XLONG: np.ndarray(2-D), (ny, nx)
+    :param XLAT: np.ndarray(2-D), (ny, nx)
+    :return:
+        corner_lon, corner_lat: np.ndarray(2-D), (ny+1, nx+1)
+    """
+    corners = []
+    for center in (XLONG, XLAT):
+        ext = np.pad(np.asarray(center, dtype=np.float64), 1, mode='reflect', reflect_type='odd')
+        corners.append((ext[:-1, :-1] + ext[1:, :-1] + ext[:-1, 1:] + ext[1:, 1:]) / 4)
+    return corners[0], corners[1]
+
+
+def build_regular_grid_cells(lon, lat, bounds=None):
+    """
+    生成规则经纬度格网的格网单元多边形，格网格式为(lon, lat)
+    :param lon: np.ndarray(1-D), 格网中心经度，递增
+    :param lat: np.ndarray(1-D), 格网中心纬度，递增
+    :param bounds: tuple | None
+        (min_lon, min_lat, max_lon, max_lat)，提供时只生成该范围内（外扩一个格网）的格网单元
+    :return:
+        cells: np.ndarray[Polygon](1-D)
+        cell_lat: np.ndarray(1-D), 格网中心纬度
+        cell_index: np.ndarray(1-D), 格网单元在整个格网展开后的序号
+    """
+    lon, lat = np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+    dlon, dlat = abs(lon[1] - lon[0]), abs(lat[1] - lat[0])
+    ilon, ilat = np.arange(len(lon)), np.arange(len(lat))
+    if bounds is not None:
+        min_lon, min_lat, max_lon, max_lat = bounds
+        ilon = ilon[(lon >= min_lon - dlon) & (lon <= max_lon + dlon)]
+        ilat = ilat[(lat >= min_lat - dlat) & (lat <= max_lat + dlat)]
+    grid_ilon, grid_ilat = np.meshgrid(ilon, ilat, indexing='ij')
+    grid_ilon, grid_ilat = grid_ilon.ravel(), grid_ilat.ravel()
+    cell_lon, cell_lat = lon[grid_ilon], lat[grid_ilat]
+    cells = shapely.box(cell_lon - dlon / 2, cell_lat - dlat / 2, cell_lon + dlon / 2, cell_lat + dlat / 2)
+    cell_index = grid_ilon * len(lat) + grid_ilat
+    return cells, cell_lat, cell_index
+
+
+def build_curvilinear_grid_cells(XLONG, XLAT):
+    """
+    生成曲线格网（如WRF的XLONG/XLAT）的格网单元多边形
+    :param XLONG: np.ndarray(2-D), (ny, nx)
+    :param XLAT: np.ndarray(2-D), (ny, nx)
+    :return:
+        cells: np.ndarray[Polygon](1-D)
+        cell_lat: np.ndarray(1-D), 格网中心纬度
+        cell_index: np.ndarray(1-D), 格网单元在整个格网展开后的序号
+    """
+    corner_lon, corner_lat = get_curvilinear_cell_corners(XLONG, XLAT)
+    ring = [(0, 0), (0, 1), (1, 1), (1, 0), (0, 0)]
+    ny, nx = np.shape(XLONG)
+    coords = np.empty((ny, nx, len(ring), 2))
+    for k, (dj, di) in enumerate(ring):
+        coords[:, :, k, 0] = corner_lon[dj:dj + ny, di:di + nx]
+        coords[:, :, k, 1] = corner_lat[dj:dj + ny, di:di + nx]
+    cells = shapely.polygons(coords.reshape(-1, len(ring), 2))
+    return cells, np.asarray(XLAT, dtype=np.float64).ravel(), np.arange(ny * nx)
+
+
+def build_zonal_weights(lon, lat, polygons):
+    """
+    计算稀疏权重矩阵，权重为多边形与格网单元的相交面积（度²）乘以格网中心纬度的cos值
+    :param lon: np.ndarray, 1-D（规则格网）或 2-D（曲线格网）
+    :param lat: np.ndarray, 1-D（规则格网）或 2-D（曲线格网）
+    :param polygons: list[Polygon | MultiPolygon]
+        每个多边形对应一个统计区域
+    :return:
+        weights: scipy.sparse.csr_matrix, (区域数, 格网数)
+    """
+    polygons = np.asarray(polygons, dtype=object)
+    if np.ndim(lon) == 1 and np.ndim(lat) == 1:
+        n_cells = len(lon) * len(lat)
+        bounds = shapely.total_bounds(polygons)
+        cells, cell_lat, cell_index = build_regular_grid_cells(lon, lat, bounds)
+    else:
+        n_cells = np.size(lon)
+        cells, cell_lat, cell_index = build_curvilinear_grid_cells(lon, lat)
+    tree = shapely.STRtree(cells)
+    region_idx, cell_idx = tree.query(polygons, predicate='intersects')
+    # 完全位于区域内的格网直接取格网面积，只对边界格网求交，
+    # 求交前先按格网外包矩形裁剪多边形，避免每次都与整个（可能有数万个顶点的）多边形求交
+    shapely.prepare(polygons)
+    overlap = shapely.area(cells[cell_idx])
+    boundary = np.flatnonzero(~shapely.contains(polygons[region_idx], cells[cell_idx]))
+    for k, (min_x, min_y, max_x, max_y) in zip(boundary, shapely.bounds(cells[cell_idx[boundary]])):
+        clipped = shapely.clip_by_rect(polygons[region_idx[k]], min_x, min_y, max_x, max_y)
+        overlap[k] = shapely.area(shapely.intersection(clipped, cells[cell_idx[k]]))
+    weight = overlap * np.cos(np.deg2rad(cell_lat[cell_idx]))
+    weights = sparse.csr_matrix((weight, (region_idx, cell_index[cell_idx])), shape=(len(polygons), n_cells))
+    weights.eliminate_zeros()
+    return weights
+
+
+def get_zonal_weights(shapefile_path, lon, lat, cache_dir=MASK_CACHE_DIR, by_feature=False):
+    """
+    获取shapefile研究区域在格网上的面积权重矩阵，优先读取磁盘缓存
+    :param shapefile_path: str | PosixPath
+    :param lon: np.ndarray, 1-D 或 2-D
+    :param lat: np.ndarray, 1-D 或 2-D
+    :param cache_dir: str | None
+        缓存目录，为None时不使用缓存
+    :param by_feature: bool
+        False：所有要素合并为一个区域，权重矩阵为(1, 格网数)
+        True：每个要素为一个区域（如gadm36_USA_2中的各县），权重矩阵为(要素数, 格网数)，
+        行顺序与read_shapefile_features返回的要素顺序一致
+    :return:
+        weights: scipy.sparse.csr_matrix, (区域数, 格网数)
+    """
+    def build():
+        if by_feature:
+            polygons, _ = read_shapefile_features(shapefile_path)
+        else:
+            polygons = [read_shapefile_polygon(shapefile_path)]
+        return build_zonal_weights(lon, lat, polygons)
+
+    if cache_dir is None:
+        return build()
+    prefix = 'zonal_features' if by_feature else 'zonal'
+    cache_path = Path(cache_dir).joinpath(
+        f'{prefix}_{get_shapefile_hash(shapefile_path)[:16]}_{get_grid_hash(lon, lat)[:16]}.npz')
+    if cache_path.exists():
+        return sparse.load_npz(cache_path).tocsr()
+    weights = build()
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    sparse.save_npz(cache_path, weights)
+    return weights
+
+
+def get_cell_cover_fraction(shapefile_path, lon, lat, cache_dir=MASK_CACHE_DIR):
+    """
+    计算每个格网单元位于研究区域内的面积比例，由（缓存的）面积权重矩阵除以格网面积得到
+    :param shapefile_path: str | PosixPath
+    :param lon: np.ndarray, 1-D 或 2-D
+    :param lat: np.ndarray, 1-D 或 2-D
+    :param cache_dir: str | None
+    :return:
+        fraction: np.ndarray, 0~1，1-D输入时形状为(len(lon), len(lat))，2-D输入时与lon/lat相同
+    """
+    weights = get_zonal_weights(shapefile_path, lon, lat, cache_dir)
+    cols = np.unique(weights.indices)
+    if np.ndim(lon) == 1 and np.ndim(lat) == 1:
+        shape = (len(lon), len(lat))
+        cell_area = abs(lon[1] - lon[0]) * abs(lat[1] - lat[0])
+        cell_lat = np.asarray(lat, dtype=np.float64)[cols % len(lat)]
+    else:
+        shape = np.shape(lon)
+        cells, cell_lat, _ = build_curvilinear_grid_cells(lon, lat)
+        cell_area, cell_lat = shapely.area(cells[cols]), cell_lat[cols]
+    fraction = np.zeros(int(np.prod(shape)), dtype=np.float64)
+    fraction[cols] = np.asarray(weights[:, cols].sum(axis=0)).ravel() / (cell_area * np.cos(np.deg2rad(cell_lat)))
+    return np.clip(fraction, 0, 1).reshape(shape)
+
+
+def zonal_mean(data, weights):
+    """
+    计算所有时刻、所有区域的面积加权均值，缺测值(nan)不参与计算（权重在有效格网上重新归一化）
+    :param data: np.ndarray, (time, 格网...)，单个时刻的格网格式需与权重矩阵一致
+    :param weights: scipy.sparse.csr_matrix, (区域数, 格网数)
+    :return:
+        np.ndarray(2-D), (time, 区域数)，区域内没有有效格网时为nan
+    """
+    data = np.asarray(data).reshape(len(data), -1)
+    # 只提取权重不为0的格网，避免对整个格网做缺测值处理
+    cols = np.unique(weights.indices)
+    sub_data = data[:, cols]
+    sub_weights = weights[:, cols]
+    valid = np.isfinite(sub_data)
+    sub_data[~valid] = 0
+    numerator = sub_weights.dot(sub_data.T)
+    denominator = sub_weights.dot(valid.T.astype(sub_data.dtype))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.asarray(numerator / denominator).T